@@ -0,0 +1,281 @@
+import os
+import gc
+import sys
+import json
+import math
+import time
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+from collections import namedtuple
+
+import lookup_topo as lt
+import tops_nodal_graph as tng
+import path_metrics as pm
+import synth_topology as st
+
+# paths per site that still fit on one sheet with the DIST/VIAS/SEGS/WVAR columns and SITE
+EXCEL_MAX_PATHS = ( 16384 - 1 ) // 4
+
+# modules that a plain path query shouldn't have to load
+HEAVY_MODULES = [ 'pandas', 'openpyxl', 'pyarrow', 'tkinter' ]
+
+# result of timing one stage of the pipeline: best wall time over the repeats (s), peak Python memory (bytes), items processed
+StageResult = namedtuple( 'StageResult', 'size stage seconds peak_bytes items unit' )
+
+def MeasureStage( stage_fn, repeat ):
+    '''
+    Runs stage_fn repeat times for the best wall time, then once more under tracemalloc for the peak memory
+        (tracemalloc slows everything down, so it's kept out of the timed runs).
+    Returns ( best seconds, peak bytes, result of the last call )
+    '''
+    best_seconds = float( 'inf' )
+    for _ in range( repeat ):
+        gc.collect()
+        start_time = time.perf_counter()
+        result = stage_fn()
+        best_seconds = min( best_seconds, time.perf_counter() - start_time )
+
+    gc.collect()
+    tracemalloc.start()
+    stage_fn()
+    _, peak_bytes = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best_seconds, peak_bytes, result
+
+def BenchmarkSize( num_segments, mesh_density, repeat, max_paths, work_dir, legacy=False, export=True, max_junction_terms=3 ):
+    '''
+    Generates one synthetic net with num_segments trace segments and times every stage of the pipeline on it
+    '''
+    top_file = os.path.join( work_dir, f'xnet_SYNTH_{num_segments}.top' )
+    st.WriteTopologyFile( top_file, num_segments, mesh_density=mesh_density, max_junction_terms=max_junction_terms )
+    with open( top_file, 'r' ) as top:
+        num_lines = sum( 1 for _ in top )
+
+    results = []
+    def Stage( stage, stage_fn, items_fn, unit ):
+        seconds, peak_bytes, result = MeasureStage( stage_fn, repeat )
+        results.append( StageResult( num_segments, stage, seconds, peak_bytes, items_fn( result ), unit ) )
+        return result
+
+    lt.SetTopologyFile( top_file )
+    topology = Stage( 'parse', lambda: lt.ParseTopologyFile( top_file ), lambda _: num_lines, 'lines' )
+    components = lt.GetTopologyData( top_file ).components
+
+    adj_list = Stage( 'adj_list', lambda: tng.GetAdjList( top_file ), lambda adj: len( adj ), 'nodes' )
+    graph = Stage( 'compact_graph', lambda: tng.BuildCompactGraph( adj_list, components ), lambda g: len( g.node_names ), 'nodes' )
+
+    start_node, end_node = 'U1_ORIGIN', 'U2_ORIGIN'
+    paths = Stage( 'enumerate', lambda: [ path for path, _ in tng.IterPaths( graph, start_node, end_node, max_paths=max_paths ) ], len, 'paths' )
+    Stage( 'shortest', lambda: tng.ShortestPaths( graph, start_node, end_node, k=10 ), len, 'paths' )
+    Stage( 'metrics', lambda: pm.PathMetrics( graph, paths ), lambda _: len( paths ), 'paths' )
+
+    if legacy:
+        # the original exhaustive DFS over the pin/_ORIGIN graph followed by the after the fact filters
+        def LegacyFilter():
+            all_paths = tng.FindAllPaths( adj_list, start_node, end_node )
+            valid_paths = tng.GetValidPaths( all_paths=all_paths, start_node=start_node, end_node=end_node )
+            return tng.RemoveDNIPaths( nodal_paths=tng.RemoveLRNodes( nodal_paths=valid_paths ) )
+        Stage( 'legacy_filter', LegacyFilter, len, 'paths' )
+
+    if export:
+        try:
+            import get_paths as gp
+            import excel_writer as ew
+        except ImportError as e:
+            print( f'Skipping export benchmark: {e}' )
+        else:
+            # one column per path per metric, and a sheet tops out at 16384 columns
+            export_paths = paths[ :EXCEL_MAX_PATHS ]
+            metrics = pm.PathMetrics( graph, export_paths )
+            path_data = [ gp.PathData( i + 1, path, float( metrics.etch_len[i] ), int( metrics.via_count[i] ), int( metrics.segment_count[i] ), float( metrics.width_variance[i] ) )
+                          for i, path in enumerate( export_paths ) ]
+            all_sites_data = { 1: gp.SiteData( 1, top_file, 'U1', 'U2', path_data ) }
+
+            def Export():
+                save_dir = os.getcwd()
+                os.chdir( work_dir )
+                try:
+                    ew.WriteDataFrameToXLSX( ew.GenerateDataFrame( all_sites_data, 'U1', 'U2' ), f'bench-{num_segments}.xlsx' )
+                finally:
+                    os.chdir( save_dir )
+            Stage( 'export', Export, lambda _: len( export_paths ), 'paths' )
+
+            def StreamedExport( output_format ):
+                with ew.PathTableWriter( os.path.join( work_dir, f'bench-{num_segments}.{output_format}' ), 'U1', 'U2', output_format=output_format ) as table_writer:
+                    for site_data in all_sites_data.values():
+                        table_writer.WriteSite( site_data )
+            for output_format in ew.OUTPUT_FORMATS:
+                Stage( f'stream_{output_format}', lambda: StreamedExport( output_format ), lambda _: len( export_paths ), 'paths' )
+
+    return results
+
+def CheckParse( work_dir, num_segments=100 ):
+    '''
+    Parses the same synthetic net written with and without the Components section around its component entries,
+        and raises if the two don't come out the same (or have no components at all).
+    '''
+    parsed = []
+    for components_section in [ True, False ]:
+        top_file = os.path.join( work_dir, f'xnet_CHECK_{int( components_section )}.top' )
+        st.WriteTopologyFile( top_file, num_segments, components_section=components_section )
+        parsed.append( lt.ParseTopologyFile( top_file ) )
+    wrapped, unwrapped = parsed
+    if not wrapped.components or unwrapped.components != wrapped.components or unwrapped.nodes != wrapped.nodes:
+        raise RuntimeError( f'Parsing without a Components section found {len( unwrapped.components )} components and {len( unwrapped.nodes )} nodes, '
+                            f'expected {len( wrapped.components )} and {len( wrapped.nodes )}' )
+
+def CheckPaths( work_dir, num_segments=20, mesh_density=0.2, junction_terms=( 3, 4, 5 ), seeds=( 0, 1, 2 ), k=10 ):
+    '''
+    Runs the path searches on small synthetic nets and raises if any of them disagrees with the slow, obviously right way:
+        * FindValidPaths() against the legacy FindAllPaths() -> GetValidPaths() -> RemoveLRNodes() -> RemoveDNIPaths() pipeline
+        * ShortestPaths() against every path from IterPaths() sorted by length
+        * PathLengthMatrix() against the path count and min/max length of IterPaths() for every pair of endpoints
+    The component ids are zero padded, GetValidPaths() matches component names as substrings and "T1" would match inside "T10".
+    Some segments are DNI so RemoveDNIPaths() has something to remove.
+    '''
+    def SameLength( a, b ):
+        return math.isclose( a, b, rel_tol=1e-9, abs_tol=1e-6 )
+
+    for max_junction_terms in junction_terms:
+        for seed in seeds:
+            net = f'{num_segments} segments, junctions of up to {max_junction_terms} terms, seed {seed}'
+            top_file = os.path.join( work_dir, f'xnet_PATHS_{max_junction_terms}_{seed}.top' )
+            st.WriteTopologyFile( top_file, num_segments, mesh_density=mesh_density, max_junction_terms=max_junction_terms, seed=seed,
+                                  id_width=len( str( num_segments * 2 ) ), dni_ratio=0.05 )
+            lt.SetTopologyFile( top_file )
+            adj_list = tng.GetAdjList( top_file )
+            graph = tng.BuildCompactGraph( adj_list, lt.GetTopologyData( top_file ).components )
+            endpoints = tng.EndpointComponents( graph )
+            start_node, end_node = ( f'{endpoint}{tng.RNS()}' for endpoint in endpoints[ :2 ] )
+
+            all_paths = tng.FindAllPaths( adj_list, start_node, end_node )
+            valid_paths = tng.GetValidPaths( all_paths=all_paths, start_node=start_node, end_node=end_node )
+            legacy_paths = tng.RemoveDNIPaths( nodal_paths=tng.RemoveLRNodes( nodal_paths=valid_paths ) )
+            found_paths = tng.FindValidPaths( graph, start_node, end_node )
+            if sorted( map( tuple, found_paths ) ) != sorted( map( tuple, legacy_paths ) ):
+                raise RuntimeError( f'FindValidPaths found {len( found_paths )} paths, the legacy pipeline {len( legacy_paths )} ({net})' )
+
+            enumerated = sorted( path_length for _, path_length in tng.IterPaths( graph, start_node, end_node ) )
+            shortest = tng.ShortestPaths( graph, start_node, end_node, k=k )
+            if len( shortest ) != min( k, len( enumerated ) ) or not all( SameLength( path_length, expected ) for ( _, path_length ), expected in zip( shortest, enumerated ) ):
+                raise RuntimeError( f'ShortestPaths lengths {[ path_length for _, path_length in shortest ]}, expected {enumerated[ :k ]} ({net})' )
+            if any( path not in found_paths for path, _ in shortest ):
+                raise RuntimeError( f'ShortestPaths returned a path that isn\'t a valid path ({net})' )
+
+            pair_lengths = tng.PathLengthMatrix( graph, endpoints )
+            for i, start in enumerate( endpoints ):
+                for end in endpoints[ i+1: ]:
+                    lengths = [ path_length for _, path_length in tng.IterPaths( graph, start, end ) ]
+                    expected = ( len( lengths ), min( lengths ), max( lengths ) ) if lengths else None
+                    found = pair_lengths.get( ( start, end ) )
+                    if ( found is None ) != ( expected is None ) or ( found and ( found[0] != expected[0] or not all( map( SameLength, found[ 1: ], expected[ 1: ] ) ) ) ):
+                        raise RuntimeError( f'PathLengthMatrix gave {found} for {start} -> {end}, expected {expected} ({net})' )
+
+def BenchmarkStartup( repeat, work_dir, num_segments=100 ):
+    '''
+    Times fresh interpreters: one that only imports get_paths, and one that runs a text-only path query on a small synthetic net.
+    These run in subprocesses so nothing is already imported, which means there's no peak memory for them.
+    Returns ( results, list of the HEAVY_MODULES that importing get_paths pulled in )
+    '''
+    repo_dir = os.path.dirname( os.path.abspath( __file__ ) )
+    tops_dir = os.path.join( work_dir, 'tops' )
+    os.makedirs( tops_dir, exist_ok=True )
+    st.WriteTopologyFile( os.path.join( tops_dir, f'xnet_SYNTH_{num_segments}.top' ), num_segments )
+
+    def Run( command ):
+        best_seconds, output = float( 'inf' ), ''
+        for _ in range( repeat ):
+            start_time = time.perf_counter()
+            output = subprocess.run( command, cwd=work_dir, env=dict( os.environ, PYTHONPATH=repo_dir ), capture_output=True, text=True, check=True ).stdout
+            best_seconds = min( best_seconds, time.perf_counter() - start_time )
+        return best_seconds, output
+
+    check_modules = f'import sys, get_paths; print( " ".join( m for m in {HEAVY_MODULES!r} if m in sys.modules ) )'
+    import_seconds, loaded = Run( [ sys.executable, '-c', check_modules ] )
+    query_seconds, query_output = Run( [ sys.executable, os.path.join( repo_dir, 'get_paths.py' ), '-n', f'xnet_SYNTH_{num_segments}.top', '-s', 'U1_S1', '-e', 'U2_S1', '-k', '1', '-f', 'text' ] )
+    # get_paths quits with a message (and exit code 0) when something is wrong with the query, so make sure it found the path
+    if 'path# 1:' not in query_output:
+        raise RuntimeError( f'Startup query did not find a path:\n{query_output}' )
+
+    results = [ StageResult( num_segments, 'startup_import', import_seconds, 0, 1, 'runs' ),
+                StageResult( num_segments, 'startup_query', query_seconds, 0, 1, 'runs' ) ]
+    return results, loaded.split()
+
+def PrintResults( results ):
+    print( f'{"size":>8} {"stage":<14} {"time (ms)":>11} {"peak mem (KiB)":>15} {"throughput":>22}' )
+    for r in results:
+        throughput = f'{r.items / r.seconds:,.0f} {r.unit}/s' if r.seconds > 0 else '-'
+        print( f'{r.size:>8} {r.stage:<14} {r.seconds * 1000:>11.2f} {r.peak_bytes / 1024:>15,.0f} {throughput:>22}' )
+
+def CompareToBaseline( results, baseline_file, tolerance ):
+    '''
+    Returns the list of ( size, stage, baseline seconds, seconds ) that got slower than tolerance x the baseline
+    '''
+    with open( baseline_file, 'r' ) as baseline:
+        baseline_seconds = { ( r[ 'size' ], r[ 'stage' ] ): r[ 'seconds' ] for r in json.load( baseline ) }
+
+    regressions = []
+    for r in results:
+        previous = baseline_seconds.get( ( r.size, r.stage ) )
+        if previous is not None and r.seconds > previous * tolerance:
+            regressions.append( ( r.size, r.stage, previous, r.seconds ) )
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser( description='Benchmark parsing, path search, metrics, and export on synthetic topology files' )
+    parser.add_argument( '--sizes', help='Number of trace segments in each synthetic net', type=int, nargs='+', default=[ 100, 1000, 10000 ] )
+    parser.add_argument( '--mesh', help='Extra segments between random junctions, as a fraction of the size', type=float, default=0.02 )
+    parser.add_argument( '--junction-terms', help='Most terminals on one junction of the synthetic nets (more makes star junctions)', type=int, default=3 )
+    parser.add_argument( '--repeat', help='Timed runs per stage (the best one is reported)', type=int, default=3 )
+    parser.add_argument( '--max-paths', help='Cap on the number of paths enumerated per net', type=int, default=1000 )
+    parser.add_argument( '--legacy', help='Also time the original FindAllPaths + GetValidPaths pipeline (slow on meshed nets)', action='store_true' )
+    parser.add_argument( '--legacy-max-size', help='Largest size to run --legacy on', type=int, default=200 )
+    parser.add_argument( '--no-export', help='Skip the Excel export stage', action='store_true' )
+    parser.add_argument( '--no-startup', help='Skip timing the startup of a text-only get_paths.py query', action='store_true' )
+    parser.add_argument( '--startup-limit', help='Fail if the text-only query takes longer than this many seconds from a cold start', type=float, default=1.0 )
+    parser.add_argument( '--json', help='Write the results to this JSON file', type=str, default=None )
+    parser.add_argument( '--baseline', help='JSON results from an earlier run to compare against', type=str, default=None )
+    parser.add_argument( '--tolerance', help='Fail if a stage is slower than this many times the baseline', type=float, default=1.5 )
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        CheckParse( work_dir )
+        CheckPaths( work_dir )
+        for num_segments in args.sizes:
+            # the recursive legacy search runs out of stack (and time) on anything but small nets
+            legacy = args.legacy and num_segments <= args.legacy_max_size
+            results += BenchmarkSize( num_segments, args.mesh, args.repeat, args.max_paths, work_dir, legacy=legacy, export=not args.no_export, max_junction_terms=args.junction_terms )
+        if not args.no_startup:
+            startup_results, heavy_modules = BenchmarkStartup( args.repeat, work_dir )
+            results += startup_results
+
+    PrintResults( results )
+
+    failed = False
+    if not args.no_startup:
+        if heavy_modules:
+            print( f'STARTUP: importing get_paths loaded {", ".join( heavy_modules )}' )
+            failed = True
+        query_seconds = startup_results[-1].seconds
+        if query_seconds > args.startup_limit:
+            print( f'STARTUP: text-only query took {query_seconds:.2f} s (limit {args.startup_limit:.2f} s)' )
+            failed = True
+
+    if args.json:
+        with open( args.json, 'w' ) as json_file:
+            json.dump( [ r._asdict() for r in results ], json_file, indent=2 )
+
+    if args.baseline:
+        regressions = CompareToBaseline( results, args.baseline, args.tolerance )
+        for size, stage, previous, seconds in regressions:
+            print( f'REGRESSION: {stage} at size {size} took {seconds * 1000:.2f} ms (baseline {previous * 1000:.2f} ms)' )
+        failed = failed or bool( regressions )
+
+    if failed:
+        sys.exit( 1 )
+
+if __name__ == "__main__":
+    main()
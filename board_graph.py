@@ -0,0 +1,215 @@
+import os
+import heapq
+from collections import Counter
+from collections import defaultdict
+from collections import namedtuple
+
+import tops_nodal_graph as tng
+import topology as tp
+
+# data about one component on the board graph: component type, trace length (MILs)
+BoardComponent = namedtuple( 'BoardComponent', 'comp_type length' )
+
+# what one topology file added to the board graph: file mtime, { board component: BoardComponent }, Counter of board edges
+FileContribution = namedtuple( 'FileContribution', 'mtime components edges' )
+
+def NetLocalTypes():
+    '''
+    Component types that only exist inside one topology file (one net), so they're never merged with components in other files
+    '''
+    return [ 'Trace', 'Via' ]
+
+def JunctionType():
+    '''
+    Type of the hubs that stand in for junctions (node listings with more than two components) on the board graph
+    '''
+    return 'Junction'
+
+def SeriesTypes():
+    '''
+    Component types that conduct from one net to another (series resistors, capacitors, etc.), so a route can pass through them.
+    ICs (IOCell) and anything else not listed here are only ever the start or end of a route.
+    '''
+    return [ 'Discrete', 'Resistor', 'Capacitor', 'Inductor' ]
+
+class BoardGraph:
+    '''
+    Component level graph of a whole PCB, merged from many topology files.
+
+    Every topology file describes one net. Components that show up in more than one net (ICs, resistors, connectors, etc.)
+        are merged on their refDes, which is what ties the nets together into one graph.
+    Trace segments and vias only belong to their own net, so they're namespaced by the absolute path of the topology file
+        they came from ( "T1@/boards/tops/xnet_CLK_1.top" ), two files with the same name in different folders never share a trace.
+    A junction gets a hub on the board graph connected to each component on it ( "N1_HUB@/boards/tops/xnet_CLK_1.top" ),
+        the same as in tops_nodal_graph.BuildAdjList(), rather than an edge between every pair of its components.
+        Hubs can be passed through but never show up in a route or in Neighbors().
+
+    Each file's contribution (components and edges) is kept separately, so when one topology file changes
+        only that file is re-read and its old contribution swapped for the new one instead of rebuilding the whole board.
+    '''
+    def __init__( self ):
+        self.topology_files = {}                # absolute path -> FileContribution
+        self.components = {}                    # board component -> BoardComponent
+        self.component_files = defaultdict(set) # board component -> topology files it shows up in
+        self.edge_counts = Counter()            # ( board component, board component ) -> number of node listings connecting them
+        self.adjacency = defaultdict(set)
+
+    def BoardComponentName( self, component, file_key ):
+        if component.comp_type in NetLocalTypes() or component.refDes is None:
+            return f'{component.refDes or component.comp_id}@{file_key}'
+        return component.refDes
+
+    def ReadContribution( self, top_file ):
+        '''
+        Turns one topology file into the board components and edges it contributes.
+        The file is loaded as its own Topology (through the topology cache), not through lookup_topo's module level state.
+        '''
+        topology = tp.LoadTopology( top_file ).data
+        file_key = os.path.abspath( top_file )
+
+        components = {}
+        board_names = {}
+        for comp_id, component in topology.components.items():
+            board_names[ comp_id ] = self.BoardComponentName( component, file_key )
+            components[ board_names[ comp_id ] ] = BoardComponent( component.comp_type, component.length if component.comp_type == 'Trace' else 0 )
+
+        edges = Counter()
+        for node_name, node_terms in zip( topology.node_names, topology.nodes ):
+            node_components = sorted( { board_names.get( tng.GetNodeRoot( term ), tng.GetNodeRoot( term ) ) for term in node_terms } )
+            if len( node_components ) == 2:
+                edges[ tuple( node_components ) ] += 1
+            elif len( node_components ) > 2:
+                hub = f'{node_name}{tng.HNS()}@{file_key}'
+                # node names should be unique, but two listings with the same name still shouldn't end up as one junction
+                if hub in components:
+                    hub = f'{node_name}.{len( components )}{tng.HNS()}@{file_key}'
+                components[ hub ] = BoardComponent( JunctionType(), 0 )
+                for component in node_components:
+                    edges[ ( component, hub ) ] += 1
+
+        return FileContribution( os.path.getmtime( top_file ), components, edges )
+
+    def AddContribution( self, file_path, contribution ):
+        for name, board_component in contribution.components.items():
+            self.components[ name ] = board_component
+            self.component_files[ name ].add( file_path )
+        for edge, count in contribution.edges.items():
+            self.edge_counts[ edge ] += count
+            self.adjacency[ edge[0] ].add( edge[1] )
+            self.adjacency[ edge[1] ].add( edge[0] )
+        self.topology_files[ file_path ] = contribution
+
+    def RemoveContribution( self, file_path ):
+        contribution = self.topology_files.pop( file_path )
+        for edge, count in contribution.edges.items():
+            self.edge_counts[ edge ] -= count
+            if self.edge_counts[ edge ] <= 0:
+                del self.edge_counts[ edge ]
+                self.adjacency[ edge[0] ].discard( edge[1] )
+                self.adjacency[ edge[1] ].discard( edge[0] )
+        for name in contribution.components:
+            self.component_files[ name ].discard( file_path )
+            if not self.component_files[ name ]:
+                del self.component_files[ name ]
+                self.components.pop( name, None )
+                self.adjacency.pop( name, None )
+
+    def AddTopologyFile( self, top_file ):
+        '''
+        Adds a topology file to the board, or updates it if it's already on the board and has changed since.
+        Returns True if the board graph changed.
+        '''
+        file_path = os.path.abspath( top_file )
+        if file_path in self.topology_files:
+            if self.topology_files[ file_path ].mtime == os.path.getmtime( file_path ):
+                return False
+            self.RemoveContribution( file_path )
+
+        self.AddContribution( file_path, self.ReadContribution( file_path ) )
+        return True
+
+    def RemoveTopologyFile( self, top_file ):
+        file_path = os.path.abspath( top_file )
+        if file_path in self.topology_files:
+            self.RemoveContribution( file_path )
+
+    def Refresh( self ):
+        '''
+        Re-reads only the topology files that changed on disk and drops the ones that were deleted.
+        Returns the list of topology files that were updated or removed.
+        '''
+        changed_files = []
+        for file_path in list( self.topology_files.keys() ):
+            if not os.path.exists( file_path ):
+                self.RemoveContribution( file_path )
+                changed_files.append( file_path )
+            elif self.AddTopologyFile( file_path ):
+                changed_files.append( file_path )
+        return changed_files
+
+    def IsHub( self, component ):
+        return self.components[ component ].comp_type == JunctionType()
+
+    def Neighbors( self, component ):
+        '''
+        Board components connected to component, directly or at a junction
+        '''
+        neighbors = set()
+        for neighbor in self.adjacency.get( component, () ):
+            if self.IsHub( neighbor ):
+                neighbors.update( self.adjacency[ neighbor ] )
+            else:
+                neighbors.add( neighbor )
+        neighbors.discard( component )
+        return sorted( neighbors )
+
+    def ComponentNets( self, component ):
+        '''
+        Topology files (nets) a board component shows up in
+        '''
+        return sorted( self.component_files.get( component, () ) )
+
+    def ShortestRoute( self, start, end, pass_through_types=None ):
+        '''
+        Shortest route by etch length between two board components, across as many nets as it takes.
+        Returns ( path, etch length ), or None if the components aren't connected.
+
+        Components in the middle of the route have to be passable: trace segments and vias always are,
+            other components only if their type is in pass_through_types (SeriesTypes() by default).
+            An IC connects many nets, and is never treated as a conductive path from one of them to another,
+            no matter how many of its nets happen to be loaded.
+        '''
+        if start not in self.components or end not in self.components:
+            return None
+
+        passable_types = set( NetLocalTypes() ) | { JunctionType() } | set( SeriesTypes() if pass_through_types is None else pass_through_types )
+        def Passable( component ):
+            return self.components[ component ].comp_type in passable_types
+
+        start_length = self.components[ start ].length or 0
+        route_lengths = { start: start_length }
+        previous = {}
+        route_queue = [ ( start_length, start ) ]
+        while route_queue:
+            route_length, component = heapq.heappop( route_queue )
+            if component == end:
+                route = [ end ]
+                while route[-1] != start:
+                    route.append( previous[ route[-1] ] )
+                return [ component for component in reversed( route ) if not self.IsHub( component ) ], route_length
+            if route_length > route_lengths[ component ] or ( component != start and not Passable( component ) ):
+                continue
+            for neighbor in self.adjacency[ component ]:
+                neighbor_length = route_length + ( self.components[ neighbor ].length or 0 )
+                if neighbor_length < route_lengths.get( neighbor, float( 'inf' ) ):
+                    route_lengths[ neighbor ] = neighbor_length
+                    previous[ neighbor ] = component
+                    heapq.heappush( route_queue, ( neighbor_length, neighbor ) )
+
+        return None
+
+def BuildBoardGraph( topo_files ):
+    board = BoardGraph()
+    for top_file in topo_files:
+        board.AddTopologyFile( top_file )
+    return board
@@ -1,34 +1,205 @@
 import os
-import pandas as pd
-import openpyxl as opxl
+import csv
+import math
+import pickle
+import tempfile
 
-def GenerateDataFrame( all_paths_data, start, end ):
-    max_num_paths = max( len( site_data.all_paths ) for site_data in all_sites_data.values() )
+import profiler
+
+# output formats for PathTableWriter
+OUTPUT_FORMATS = [ 'xlsx', 'csv', 'parquet' ]
+
+def MetricColumns():
+    '''
+    ( column label, PathData field ) for each group of path columns, in the order they're written:
+        DIST (etch length), VIAS (via count), SEGS (trace segments), WVAR (trace width variance)
+    '''
+    return [ ( 'DIST', 'etch_len' ), ( 'VIAS', 'via_count' ), ( 'SEGS', 'segment_count' ), ( 'WVAR', 'width_variance' ) ]
+
+def PathColumnNames( start, end, metric_columns, max_num_paths ):
+    return [ f'{start}.{end}.{col}.{i}' for col, _ in metric_columns for i in range( 1, max_num_paths+1 ) ]
+
+def OutputFilePath( filename ):
+    '''
+    Absolute path for an output file in the Board_Data folder (created if needed) of the current directory
+    '''
+    output_file_folder = 'Board_Data'
+    if not os.path.exists( output_file_folder ):
+        os.makedirs( output_file_folder )
+    return os.path.abspath( f'{output_file_folder}/{filename}' )
+
+@profiler.Timed( 'dataframe' )
+def GenerateDataFrame( all_sites_data, start, end ):
+    '''
+    One row per site (all_sites_data maps site number -> SiteData), one column per path for each path metric (distance first), and the SITE number last
+    '''
+    import pandas as pd
+
+    max_num_paths = max( ( len( site_data.all_paths ) for site_data in all_sites_data.values() ), default=0 )
     # print( max_num_paths )
 
-    col_names = [ f'{start}.{end}.DIST.{i}' for i in range( 1, max_num_paths+1 ) ]
+    # the path metrics go in their own groups of columns after the distances
+    all_paths = [ path_data for site_data in all_sites_data.values() for path_data in site_data.all_paths ]
+    metric_columns = [ ( col, field ) for col, field in MetricColumns() if all( getattr( path_data, field ) is not None for path_data in all_paths ) ]
+
+    col_names = PathColumnNames( start, end, metric_columns, max_num_paths )
 
-    path_distances = []
+    site_rows = []
     for site_data in all_sites_data.values():
         # print( site_data )
-        path_distances.append( [ path_data.etch_len for path_data in site_data.all_paths ] )
-    
+        site_row = []
+        for _, field in metric_columns:
+            site_values = [ getattr( path_data, field ) for path_data in site_data.all_paths ]
+            # pad so every metric group lines up with its columns, even for sites with fewer paths
+            site_row += site_values + [ None ] * ( max_num_paths - len( site_values ) )
+        site_rows.append( site_row )
+
     # col_names.append( 'SITE' )
-    
 
-    df = pd.DataFrame( path_distances, index=list( range(1,126+1) ), columns=col_names )
+
+    df = pd.DataFrame( site_rows, index=list( all_sites_data.keys() ), columns=col_names )
 
     # set the SITE col last to make sure it's the last col
     df[ 'SITE' ] = df.index.tolist()
     return df
 
-def WriteDataFrameToXLSX( df, xl_filename ):
-    output_file_folder = 'Board_Data'
-    if not os.path.exists( output_file_folder ):
-        os.makedirs( output_file_folder )
-    output_file_path = f'{output_file_folder}/{xl_filename}'
+def GenerateMatrixDataFrame( pair_lengths ):
+    '''
+    One row per pair of components: pair_lengths maps ( start refDes, end refDes ) -> ( number of paths, min length, max length )
+    '''
+    import pandas as pd
+
+    rows = [ [ start, end, num_paths, min_len, max_len ] for ( start, end ), ( num_paths, min_len, max_len ) in pair_lengths.items() ]
+    return pd.DataFrame( rows, columns=[ 'START', 'END', 'PATHS', 'MIN.DIST', 'MAX.DIST' ] )
+
+@profiler.Timed( 'export' )
+def WriteDataFrameToXLSX( df, xl_filename, sheet_name='Path Data' ):
+    import pandas as pd
+
+    output_file_path = OutputFilePath( xl_filename )
+
+    with pd.ExcelWriter( output_file_path, engine = 'openpyxl' ) as writer:
+        df.to_excel( excel_writer=writer, sheet_name=sheet_name, index=False )
+
+class PathTableWriter:
+    '''
+    Writes the same table as GenerateDataFrame() (one row per site, START.END.DIST.i columns and the other metric groups, SITE last)
+        one site at a time, without building a DataFrame.
+
+    The header depends on the most paths found at any site, which isn't known until every site is in,
+        so each site's values are pickled to a temporary spool file as soon as the site is written.
+    Close() then streams the spool into the output file: a write-only openpyxl workbook for xlsx,
+        the csv module for csv, or row groups through pyarrow for parquet.
+    Only one site's values are ever held in memory at a time.
+    '''
+    def __init__( self, output_file, start, end, output_format='xlsx', sheet_name='Path Data' ):
+        if output_format not in OUTPUT_FORMATS:
+            raise ValueError( f'Unknown output format "{output_format}", expected one of {OUTPUT_FORMATS}' )
+        self.output_file = output_file
+        self.start = start
+        self.end = end
+        self.output_format = output_format
+        self.sheet_name = sheet_name
+
+        self.spool = tempfile.TemporaryFile()
+        self.max_num_paths = 0
+        # a metric group is only written if every path at every site has a value for it
+        self.metric_present = { field: True for _, field in MetricColumns() }
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        if exc_type is None:
+            self.Close()
+        else:
+            self.spool.close()
+
+    def WriteSite( self, site_data ):
+        site_values = {}
+        for _, field in MetricColumns():
+            site_values[ field ] = [ getattr( path_data, field ) for path_data in site_data.all_paths ]
+            if any( value is None for value in site_values[ field ] ):
+                self.metric_present[ field ] = False
+
+        self.max_num_paths = max( self.max_num_paths, len( site_data.all_paths ) )
+        pickle.dump( ( site_data.site, site_values ), self.spool, protocol=pickle.HIGHEST_PROTOCOL )
+
+    def MetricColumns( self ):
+        return [ ( col, field ) for col, field in MetricColumns() if self.metric_present[ field ] ]
+
+    def Header( self ):
+        return PathColumnNames( self.start, self.end, self.MetricColumns(), self.max_num_paths ) + [ 'SITE' ]
+
+    def Rows( self ):
+        '''
+        Reads the spooled sites back in order, padded out to the full width of the table (None for missing or NaN values)
+        '''
+        metric_columns = self.MetricColumns()
+        self.spool.seek( 0 )
+        while True:
+            try:
+                site_num, site_values = pickle.load( self.spool )
+            except EOFError:
+                return
+
+            site_row = []
+            for _, field in metric_columns:
+                values = [ None if isinstance( value, float ) and math.isnan( value ) else value for value in site_values[ field ] ]
+                site_row += values + [ None ] * ( self.max_num_paths - len( values ) )
+            site_row.append( site_num )
+            yield site_row
+
+    @profiler.Timed( 'export' )
+    def Close( self ):
+        try:
+            if self.output_format == 'xlsx':
+                self.WriteXLSX()
+            elif self.output_format == 'csv':
+                self.WriteCSV()
+            else:
+                self.WriteParquet()
+        finally:
+            self.spool.close()
+
+    def WriteXLSX( self ):
+        import openpyxl as opxl
+
+        workbook = opxl.Workbook( write_only=True )
+        worksheet = workbook.create_sheet( title=self.sheet_name )
+        worksheet.append( self.Header() )
+        for site_row in self.Rows():
+            worksheet.append( site_row )
+        workbook.save( self.output_file )
+
+    def WriteCSV( self ):
+        with open( self.output_file, 'w', newline='' ) as csv_file:
+            writer = csv.writer( csv_file )
+            writer.writerow( self.Header() )
+            for site_row in self.Rows():
+                writer.writerow( [ '' if value is None else value for value in site_row ] )
+
+    def WriteParquet( self, rows_per_group=1000 ):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError( 'Writing parquet files needs pyarrow (pip install pyarrow)' )
+
+        count_fields = [ 'via_count', 'segment_count' ]
+        column_types = [ pa.int64() if field in count_fields else pa.float64() for _, field in self.MetricColumns() for _ in range( self.max_num_paths ) ]
+        schema = pa.schema( list( zip( self.Header(), column_types + [ pa.int64() ] ) ) )
+
+        def WriteRowGroup( writer, site_rows ):
+            columns = list( zip( *site_rows ) )
+            writer.write_table( pa.Table.from_arrays( [ pa.array( column, type=field.type ) for column, field in zip( columns, schema ) ], schema=schema ) )
 
-    writer = pd.ExcelWriter( output_file_path, engine = 'openpyxl' )
-    df.to_excel( excel_writer=writer, sheet_name='Path Data', index=False )
-    writer.save()
-    writer.close()
\ No newline at end of file
+        with pq.ParquetWriter( self.output_file, schema ) as writer:
+            site_rows = []
+            for site_row in self.Rows():
+                site_rows.append( site_row )
+                if len( site_rows ) == rows_per_group:
+                    WriteRowGroup( writer, site_rows )
+                    site_rows = []
+            if site_rows:
+                WriteRowGroup( writer, site_rows )
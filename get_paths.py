@@ -1,20 +1,27 @@
 import os
 import re
+import glob
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 from collections import namedtuple
-import pandas as pd
 
 import tops_nodal_graph as tng
 import lookup_topo as lt
 import input_parser as ip
 import excel_writer as ew
+import topo_cache as tc
+import path_metrics as pm
+import site_memo as sm
+import topology as tp
+import profiler
 
 # data about all the paths from start to end in a given site: start, end, all possible paths
 # a Site is defined as one area on the PCB that is repeated across the PCB many times, like a set of testing probes, a set of memory chips, a set of power supplies, etc.
 SiteData = namedtuple( 'SiteData', 'site topology_file start_node end_node all_paths' )
 
-# data about one unique path: node path and dist 
-PathData = namedtuple( 'PathData', 'path_num node_path etch_len' )
+# data about one unique path: node path, dist, and the metrics from path_metrics (number of vias, number of trace segments, variance in trace width)
+# refDes_path is only filled in when the path came from the query server, which has the component table and saves the client from parsing the file
+PathData = namedtuple( 'PathData', 'path_num node_path etch_len via_count segment_count width_variance refDes_path', defaults=( None, None, None, None ) )
 
 def GetSiteInfo( filename: str ):
     filename_extract = re.search( r'xnet_([^_]+)_([0-9]+).top$', filename )
@@ -28,13 +35,19 @@ def AddSiteSuffix( node_name, site_num ):
 def PrintValidPaths( site_data ):
     # lt.SetTopologyFile( top_file=site_data.topology_file )
     site_num = site_data.site
-    print( f'Site {site_num}: Found {len( site_data.all_paths )} paths from {site_data.start_node}_S{site_num} to {site_data.end_node}_S{site_num}')
+    print( f'Site {site_num}: Found {len( site_data.all_paths )} paths from {site_data.start_node} to {site_data.end_node}')
 
+    # the refDes come from the site's cached component table, only loaded if the paths don't have them already
+    index = None
     for i, path_data in enumerate( site_data.all_paths, start = 1 ):
-        path = path_data.node_path
-        path_str = ', '.join( tng.GetPathRefDes( path_data.node_path, site_data.topology_file ) )
+        path_refDes = path_data.refDes_path
+        if path_refDes is None:
+            if index is None:
+                index = lt.TopologyIndex( tc.LoadTopology( site_data.topology_file )[ 'topology' ] )
+            path_refDes = index.PathRefDes( path_data.node_path )
+        path_str = ', '.join( path_refDes )
         print( f'path# {i}: [ {path_str} ]' )
-        print( f'\tlength of path# {i}: {tng.PathLength( path )} (MILs)')
+        print( f'\tlength of path# {i}: {path_data.etch_len} (MILs)')
     print()
 
 # sort the list of topology files by the integer at the end of the filename instead of standard string ordering
@@ -43,8 +56,232 @@ def atoi( text ):
 def numeric_keys( text ):
     return [ atoi(t) for t in re.split('(\d+)', text) ]
 
-def main():
-    target_net, start, end = ip.ParseInputArgs()
+def FindSiteFiles( net_name, tops_dir='.' ):
+    '''
+    File names of all the xnet_<NET>_<SITE>.top files for a net in tops_dir (the current directory by default), in site order
+    '''
+    site_files = [ os.path.basename( f ) for f in glob.glob( os.path.join( tops_dir, f'xnet_{net_name}_*.top' ) ) ]
+    site_files = [ f for f in site_files if re.search( r'xnet_([^_]+)_([0-9]+).top$', f ) ]
+    return sorted( site_files, key=numeric_keys )
+
+def ProcessSite( topo_file, start, end, add_site_suffix=False, shortest=None, max_paths=None, max_length=None ):
+    '''
+    Parses one topology file and finds all the paths from start to end in it.
+    This is the unit of work handed to each worker process in batch mode, so it only relies on its arguments.
+    '''
+    net_name, site_num = GetSiteInfo( topo_file )
+    start_refDes = AddSiteSuffix( start, site_num ) if add_site_suffix else start
+    end_refDes = AddSiteSuffix( end, site_num ) if add_site_suffix else end
+
+    # transform topology file into nodal graph (reuses the cached graph from a previous run if the file hasn't changed)
+    topology = tp.LoadTopology( topo_file )
+
+    # _ORIGIN suffix is needed to for the implementation of this nodal graph
+    start_node = SiteNode( topology, start_refDes )
+    end_node = SiteNode( topology, end_refDes )
+
+    all_paths_list_temp = SearchPaths( topology.graph, start_node, end_node, shortest=shortest, max_paths=max_paths, max_length=max_length )
+
+    # Store data from all paths into a Site data object
+    return SiteData( site_num, topo_file, start, end, all_paths_list_temp )
+
+def SiteNode( topology, refDes ):
+    '''
+    _ORIGIN node of a refDes in a Topology, quitting if the refDes isn't in it
+    '''
+    node = topology.OriginNode( refDes )
+    if node is None:
+        print( f'Error: node "{refDes}" is not in this topology file. Quitting...' )
+        quit()
+    return node
+
+def SearchPaths( graph, start_node, end_node, shortest=None, max_paths=None, max_length=None ):
+    '''
+    PathData for every valid path from start_node to end_node in a CompactGraph (or just the shortest ones), numbered from 1
+    '''
+    # invalid paths (through a component pin instead of its origin, through the end component, through DNI components) are never built
+    if shortest is not None:
+        found_paths = tng.ShortestPaths( graph, start_node, end_node, k=shortest, max_length=max_length )
+    else:
+        found_paths = tng.IterPaths( graph, start_node, end_node, max_paths=max_paths, max_length=max_length )
+    with profiler.stats.Stage( 'search' ):
+        node_paths = [ path for path, _ in found_paths ]
+
+    return MeasurePaths( graph, node_paths )
+
+def MeasurePaths( graph, node_paths ):
+    '''
+    PathData for every path (lists of component roots) in a CompactGraph, numbered from 1, with all of the path metrics computed in one pass
+    '''
+    metrics = pm.PathMetrics( graph, node_paths )
+    all_paths = []
+    for i, path in enumerate( node_paths ):
+        all_paths.append( PathData( i + 1, path, float( metrics.etch_len[i] ), int( metrics.via_count[i] ), int( metrics.segment_count[i] ), float( metrics.width_variance[i] ) ) )
+    return all_paths
+
+def RemeasureSite( topo_file, start, end, node_paths ):
+    '''
+    SiteData for a site with the same structure as one that was already searched (see site_memo),
+        with the paths found there (node_paths) measured on this site's own lengths and widths
+    '''
+    _, site_num = GetSiteInfo( topo_file )
+    return SiteData( site_num, topo_file, start, end, MeasurePaths( tp.LoadTopology( topo_file ).graph, node_paths ) )
+
+def ProfiledCall( fn, *args, **kwargs ):
+    '''
+    fn() with profiling turned on in the worker process, returning ( result, profile stats ) so the stats can be merged
+    '''
+    profiler.Enable()
+    profiler.stats.Reset()
+    result = fn( *args, **kwargs )
+    return result, profiler.stats.AsDict()
+
+def IterProcessSites( site_files, start, end, num_workers=None, memoize=True, **path_options ):
+    '''
+    Runs ProcessSite() for every site file across a pool of worker processes (one per core by default),
+        yielding each site's SiteData in site order as soon as it's done.
+    If profiling is on, the stats from every worker are merged into this process's stats.
+
+    With memoize, sites that are copies of each other (same site_memo.SearchKey()) are only searched once:
+        * sites with the same geometry too just get the paths of the first one
+        * the rest get the paths of the first one measured again on their own lengths and widths
+    The search itself depends on the lengths for shortest paths and max length, so then only sites with the same geometry are copies.
+    '''
+    site_options = dict( start=start, end=end, add_site_suffix=True, **path_options )
+    with ProcessPoolExecutor( max_workers=num_workers ) as pool:
+        def Submit( fn, *args, **kwargs ):
+            if profiler.stats.enabled:
+                return pool.submit( ProfiledCall, fn, *args, **kwargs )
+            return pool.submit( fn, *args, **kwargs )
+
+        def Result( future ):
+            if not profiler.stats.enabled:
+                return future.result()
+            result, worker_stats = future.result()
+            profiler.stats.Merge( worker_stats )
+            return result
+
+        if not memoize:
+            site_futures = [ Submit( ProcessSite, site_file, **site_options ) for site_file in site_files ]
+            for future in site_futures:
+                yield Result( future )
+            return
+
+        site_keys = [ Result( future ) for future in [ Submit( tc.LoadSiteKeys, site_file ) for site_file in site_files ] ]
+        search_keys = [ sm.SearchKey( keys, start, end, **path_options ) for keys in site_keys ]
+
+        # the first site with each search key gets searched, the others wait for its paths
+        first_sites = {}
+        site_futures = {}
+        reusing_sites = defaultdict( list )
+        for i, search_key in enumerate( search_keys ):
+            if search_key in first_sites:
+                reusing_sites[ search_key ].append( i )
+            else:
+                first_sites[ search_key ] = i
+                site_futures[ i ] = Submit( ProcessSite, site_files[i], **site_options )
+
+        # search key -> SiteData of the site that was searched
+        searched_sites = {}
+        for i, ( site_file, search_key ) in enumerate( zip( site_files, search_keys ) ):
+            if first_sites[ search_key ] == i:
+                site_data = Result( site_futures.pop( i ) )
+                searched_sites[ search_key ] = site_data
+                profiler.stats.Count( 'memo.searched' )
+                # sites with different geometry are measured as soon as there are paths to measure
+                node_paths = [ path_data.node_path for path_data in site_data.all_paths ]
+                for j in reusing_sites.pop( search_key, [] ):
+                    if site_keys[j].geometry != site_keys[i].geometry:
+                        site_futures[ j ] = Submit( RemeasureSite, site_files[j], start, end, node_paths )
+            elif i in site_futures:
+                site_data = Result( site_futures.pop( i ) )
+                profiler.stats.Count( 'memo.remeasured' )
+            else:
+                _, site_num = GetSiteInfo( site_file )
+                site_data = SiteData( site_num, site_file, start, end, searched_sites[ search_key ].all_paths )
+                profiler.stats.Count( 'memo.reused' )
+            yield site_data
+
+def ProcessSites( site_files, start, end, num_workers=None, memoize=True, **path_options ):
+    '''
+    Returns { site number: SiteData } for every site file in site order (see IterProcessSites())
+    '''
+    all_sites = IterProcessSites( site_files, start, end, num_workers=num_workers, memoize=memoize, **path_options )
+    return { site_data.site: site_data for site_data in sorted( all_sites, key=lambda site_data: site_data.site ) }
+
+def ProcessAllPairs( topo_file, max_length=None ):
+    '''
+    Path count and min/max etch length between every pair of endpoint components in one topology file, keyed by refDes
+    '''
+    topology = tp.LoadTopology( topo_file )
+    pair_lengths = topology.PathLengthMatrix( max_length=max_length )
+    return { tuple( topology.PathRefDes( pair ) ): pair_data for pair, pair_data in pair_lengths.items() }
+
+def WriteProfile( profile_output ):
+    '''
+    Writes the profile stats as JSON to profile_output, or to stdout for "-"
+    '''
+    if profile_output == '-':
+        print( profiler.stats.ToJSON() )
+    else:
+        with open( profile_output, 'w' ) as profile_file:
+            profile_file.write( profiler.stats.ToJSON() )
+
+def WritePairLengths( pair_lengths, target_net ):
+    '''
+    Prints the path count and min/max length for every pair of components and writes them to the path matrix spreadsheet
+    '''
+    print( f'Found paths between {len( pair_lengths )} pairs of components' )
+    for ( pair_start, pair_end ), ( num_paths, min_len, max_len ) in pair_lengths.items():
+        print( f'{pair_start} -> {pair_end}: {num_paths} paths, {min_len} - {max_len} (MILs)' )
+
+    pairs_df = ew.GenerateMatrixDataFrame( pair_lengths )
+    print( 'Writing path matrix to Excel...' )
+    ew.WriteDataFrameToXLSX( pairs_df, f'{os.path.splitext( target_net )[0]}-path-matrix.xlsx', sheet_name='Path Matrix' )
+    print( 'done!' )
+
+def WriteSites( all_sites, args, output_file ):
+    '''
+    Prints the paths of every site (-f text) or writes each site's row to output_file as soon as the site is processed
+    '''
+    if args.format == 'text':
+        for site_data in all_sites:
+            PrintValidPaths( site_data )
+        return
+
+    with ew.PathTableWriter( output_file, args.start, args.end, output_format=args.format ) as table_writer:
+        for site_data in all_sites:
+            if args.batch:
+                print( f'Site {site_data.site}: Found {len( site_data.all_paths )} paths' )
+            table_writer.WriteSite( site_data )
+
+        print( f'Writing path data to {os.path.basename( output_file )}...' )
+    print( 'done!' )
+
+def RunServerQuery( args, output_file ):
+    '''
+    Sends the query to a running topo_server instead, which already has the topology files loaded
+    '''
+    import topo_server as ts
+
+    path_options = { 'shortest': args.shortest, 'max_paths': args.max_paths, 'max_length': args.max_length }
+    try:
+        if args.all_pairs:
+            pair_lengths = ts.QueryAllPairs( args.server, args.net, max_length=args.max_length )
+        else:
+            all_sites = ts.QuerySites( args.server, args.net, args.start, args.end, batch=args.batch, **path_options )
+    except ts.QueryError as e:
+        print( f'{e}. Quitting...' )
+        quit()
+
+    if args.all_pairs:
+        WritePairLengths( pair_lengths, args.net )
+    else:
+        WriteSites( all_sites, args, output_file )
+
+def RunQuery( args ):
+    target_net, start, end = args.net, args.start, args.end
+
     if start in tng.DNIList():
         print( f'Start Node: {start} is labeled DNI in the schematic. Choose components that are not DNI.')
         quit()
@@ -52,46 +289,63 @@ def main():
         print( f'End Node: {end} is labeled DNI in the schematic. Choose components that are not DNI.')
         quit()
 
-    topo_dir = '.\\tops'
+    # output goes in Board_Data next to the tops directory
+    output_file = None
+    if not args.all_pairs and args.format != 'text':
+        output_file = ew.OutputFilePath( f'{start}-{end}-path-data.{args.format}' )
+
+    if args.server:
+        RunServerQuery( args, output_file )
+        return
+
+    topo_dir = os.path.join( '.', 'tops' )
     try:
         os.chdir( topo_dir )
     except FileNotFoundError:
         print(f'The directory "{topo_dir}" cannot be found. Quitting...')
         quit()
 
-    # topology file path
-    topo_file_to_parse = target_net
+    if args.all_pairs:
+        pair_lengths = ProcessAllPairs( target_net, max_length=args.max_length )
+        os.chdir('..')
+        WritePairLengths( pair_lengths, target_net )
+        return
 
-    lt.SetTopologyFile( top_file=topo_file_to_parse )
+    path_options = { 'shortest': args.shortest, 'max_paths': args.max_paths, 'max_length': args.max_length }
 
-    # transform topology file into nodal graph
-    edge_list = tng.GetAdjList( topo_file=topo_file_to_parse )
+    if args.batch:
+        # -n is the net name, every xnet_<NET>_<SITE>.top file for it gets processed
+        site_files = FindSiteFiles( target_net )
+        if not site_files:
+            print( f'No topology files found for net "{target_net}". Quitting...' )
+            quit()
+        print( f'Processing {len( site_files )} sites of net {target_net}...' )
+        all_sites = IterProcessSites( site_files, start, end, num_workers=args.jobs, memoize=not args.no_memo, **path_options )
+    else:
+        # topology file path
+        topo_file_to_parse = target_net
+        all_sites = [ ProcessSite( topo_file_to_parse, start, end, **path_options ) ]
 
-    net_name, site_num = GetSiteInfo( topo_file_to_parse )
+    WriteSites( all_sites, args, output_file )
+    os.chdir('..')
 
-    # _ORIGIN suffix is needed to for the implementation of this nodal graph
-    start_node = '{0}_ORIGIN'.format( tng.RefDesToNode( start ) )
-    end_node = '{0}_ORIGIN'.format( tng.RefDesToNode( end ) )
-
-    # print( f'Analyzing Net: {target_net}, Site: {site_num}')
-    tng.FindAllPaths( edge_list, start_node, end_node )
-    # this implementation creates duplicate or redundant paths that need to be trimmed
-    valid_paths = tng.GetValidPaths( all_paths=tng.ConnectionPaths(), start_node=start_node, end_node=end_node )
-    valid_paths = tng.RemoveLRNodes( nodal_paths=valid_paths )
-    valid_paths = tng.RemoveDNIPaths( nodal_paths=valid_paths )
-
-    # Create a data object for every valid path from start_node to end_node
-    all_paths_list_temp = []
-    for i, path in enumerate(  valid_paths , start = 1 ):
-        all_paths_list_temp.append( PathData( i, path, tng.PathLength( path ) ) )
-    # Store data from all paths into a Site data object
-    AllPaths = SiteData( 1, topo_file_to_parse, start, end, all_paths_list_temp )
+def main():
+    args = ip.ParseInputArgs()
+    if args.serve:
+        import topo_server as ts
+        ts.Serve( os.path.join( '.', 'tops' ), host=args.host, port=args.port, max_graphs=args.max_graphs )
+        return
 
-    AllPaths_df = ew.GenerateDataFrame( all_paths_data=AllPaths, start=start, end=end )
-    print( 'Writing path data to Excel...' )
-    os.chdir('..')
-    ew.WriteDataFrameToXLSX( AllPaths_df, f'{start}-{end}-path-data.xlsx' )
-    print( 'done!' )
+    if args.profile:
+        profiler.Enable()
+        # the output file is relative to where the tool was run from, not the tops directory
+        if args.profile != '-':
+            args.profile = os.path.abspath( args.profile )
+    try:
+        RunQuery( args )
+    finally:
+        if args.profile:
+            WriteProfile( args.profile )
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
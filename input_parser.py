@@ -1,17 +1,45 @@
 import os
 import argparse
-from tkinter import Tk
-from tkinter.filedialog import askopenfilename
 
 def ParseInputArgs():
     parser = argparse.ArgumentParser( description='Calculate the distance between two components in a topology file' )
-    parser.add_argument( '-n', '--net', help='XNet (assuming topology file is named after Xnet) containing the start and end nodes', type=str, required=True )
-    parser.add_argument( '-s', '--start', help='Start of the path', type=str, required=True )
-    parser.add_argument( '-e', '--end', help='End of the path', type=str, required=True )
+    parser.add_argument( '-n', '--net', help='XNet (assuming topology file is named after Xnet) containing the start and end nodes', type=str )
+    parser.add_argument( '-s', '--start', help='Start of the path', type=str )
+    parser.add_argument( '-e', '--end', help='End of the path', type=str )
+    parser.add_argument( '-a', '--all-pairs', help='Find the path count and min/max etch length between every pair of components in the net', action='store_true' )
+    parser.add_argument( '-b', '--batch', help='Treat --net as a net name and process every xnet_<NET>_<SITE>.top file for it', action='store_true' )
+    parser.add_argument( '-j', '--jobs', help='Number of worker processes for --batch (defaults to one per core)', type=int, default=None )
+    parser.add_argument( '--no-memo', help='Search every site for --batch, even the ones that are copies of a site already searched', action='store_true' )
+    parser.add_argument( '-k', '--shortest', help='Only find the K shortest paths (by etch length) from start to end', type=int, default=None, metavar='K' )
+    parser.add_argument( '--max-paths', help='Stop after finding this many paths', type=int, default=None )
+    parser.add_argument( '--max-length', help='Ignore paths with an etch length longer than this (MILs)', type=float, default=None )
+    parser.add_argument( '-f', '--format', help='Output file format for the path data (text just prints the paths)', choices=[ 'xlsx', 'csv', 'parquet', 'text' ], default='xlsx' )
+    parser.add_argument( '--profile', help='Time each stage and count the work done, written as JSON to FILE (stdout if no FILE)', nargs='?', const='-', default=None, metavar='FILE' )
+    parser.add_argument( '--serve', help='Run a query server that keeps the graphs of the tops directory in memory (no query is run)', action='store_true' )
+    parser.add_argument( '--host', help='Address for --serve to listen on', type=str, default='127.0.0.1' )
+    parser.add_argument( '--port', help='Port for --serve to listen on', type=int, default=8765 )
+    parser.add_argument( '--max-graphs', help='Number of topology files --serve keeps loaded before dropping the least recently used', type=int, default=64 )
+    parser.add_argument( '--server', help='Send the query to a server started with --serve instead of parsing the files here (e.g. http://127.0.0.1:8765)', type=str, default=None, metavar='URL' )
     args = parser.parse_args()
-    return args.net, args.start, args.end
+
+    if args.serve:
+        if args.server:
+            parser.error( '--serve and --server cannot be used together' )
+        return args
+
+    if args.net is None:
+        parser.error( 'the following arguments are required: -n/--net (unless using --serve)' )
+    if args.all_pairs and args.batch:
+        parser.error( '--all-pairs works on a single topology file and cannot be combined with --batch' )
+    if not args.all_pairs and ( args.start is None or args.end is None ):
+        parser.error( 'the following arguments are required: -s/--start, -e/--end (unless using --all-pairs)' )
+    return args
 
 def BrowseFile() -> str:
+    # tkinter is only needed for the file dialog, and isn't there at all on some headless installs
+    from tkinter import Tk
+    from tkinter.filedialog import askopenfilename
+
     Tk().withdraw() # we don't want a full GUI, so keep the root window from appearing
     # print( os.getcwd() )
     filename = askopenfilename( initialdir = f'{os.getcwd()}/tops', title = 'Select Netlist File') # show an "Open" dialog box and return the path to the selected file
@@ -1,10 +1,42 @@
 import re
 import os
-from decimal import Decimal
+import threading
+from collections import namedtuple
 
+import topo_tokenizer as tt
+import profiler
+
+# the "current" topology file of the old single file scripts (see SetTopologyFile()).
+#   It's shared by every thread, so anything that works on more than one file at once should use topology.Topology instead
 topo_file = ''
 
+# design prefix Allegro puts in front of every component id in the topology files of this board ( "6624020A.C1" )
+# parsing doesn't depend on it, it's only used to write synthetic topology files
+DESIGN_PREFIX = '6624020A'
+
+# data about one component in the topology file: component id, component type, refDes, trace length and width (MILs),
+#   properties ( name -> value exactly as written in the file )
+Component = namedtuple( 'Component', 'comp_id comp_type refDes length width props' )
+
+# everything pulled out of one pass over a topology file: the component table ( comp_id -> Component ), the Nodes listing (terminals of each node), and the name of each node
+TopologyData = namedtuple( 'TopologyData', 'topology_file components nodes node_names' )
+
+# parsed topology files, keyed by absolute path. Each entry is ( mtime, TopologyData ) so an edited file gets re-parsed
+parsed_topologies = {}
+
+# TopologyIndex for each parsed topology file, keyed by absolute path. Each entry is ( TopologyData, TopologyIndex ) so the index is rebuilt with the file
+topology_indexes = {}
+
+# held while reading or updating parsed_topologies and topology_indexes (re-entrant since GetTopologyIndex() calls GetTopologyData())
+cache_lock = threading.RLock()
+
+# a property value that is a number, maybe with a unit after a space or a % ( "22 OHM", "1.5%", "-3" )
+number_value_re = re.compile( r'\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)(?:\s*%|\s+[A-Za-z]+)?\s*' )
+
 def SetTopologyFile( top_file ):
+    '''
+    Sets the topology file every lookup without a file argument uses. Not thread-safe: it's the same file for every thread
+    '''
     global topo_file
     topo_file = top_file
 
@@ -16,81 +48,169 @@ def CheckTopologyFileInitialized():
 def GetTopologyFile():
     return topo_file
 
+@profiler.Timed( 'parse' )
+def ParseTopologyFile( top_file ):
+    '''
+    Reads the topology file once, top to bottom (see topo_tokenizer), and builds the component table and the Nodes listing.
+
+    ------------------------------------------------------------
+    ("6624020A.T1" Trace
+        (refDes "T1")
+        (length "100.5 MIL")
+        (width "5.0 MIL")
+        (Props
+            (LAYER "TOP")
+        )
+    )
+    ...
+    (Nodes
+        ("node1"
+            (terms "6624020A.C1.1" "6624020A.T1.1")
+        )
+        ...
+    )
+    ------------------------------------------------------------
+
+    The design prefix ( "6624020A" ) can be anything, it's dropped from the component ids and node terminals.
+    '''
+    components = {}
+    nodes = []
+    node_names = []
+
+    for record in tt.IterRecords( top_file ):
+        if isinstance( record, tt.NodeRecord ):
+            nodes.append( record.terms )
+            node_names.append( record.name )
+        else:
+            components[ record.comp_id ] = Component( record.comp_id, record.comp_type, record.refDes, record.length, record.width, record.props )
+
+    return TopologyData( top_file, components, nodes, node_names )
+
+def GetTopologyData( top_file=None ):
+    '''
+    Returns the parsed topology file, only parsing it if it hasn't been parsed yet or has changed since the last parse
+    '''
+    if top_file is None:
+        CheckTopologyFileInitialized()
+        top_file = topo_file
+
+    file_key = os.path.abspath( top_file )
+    mtime = os.path.getmtime( file_key )
+    with cache_lock:
+        if file_key not in parsed_topologies or parsed_topologies[ file_key ][0] != mtime:
+            parsed_topologies[ file_key ] = ( mtime, ParseTopologyFile( top_file ) )
+
+        return parsed_topologies[ file_key ][1]
+
+def TypedPropertyValue( prop_value ):
+    '''
+    Property values that are a whole number, maybe with a unit ( "22 OHM" -> 22.0, "1.5%" -> 1.5 ), become floats.
+    Anything else stays the string from the file ( "L3", "VIA8", "rev 2 (alt)" ), and so do:
+        * numbers with leading zeros, which are codes ( package "0402" ) rather than values
+        * numbers with letters stuck to them ( "10K", "4.7uF" ), since the letters can be a multiplier
+    '''
+    number_match = number_value_re.fullmatch( prop_value )
+    if number_match is None:
+        return prop_value
+    number = number_match.group( 1 ).lstrip( '+-' )
+    if len( number ) > 1 and number[0] == '0' and number[1].isdigit():
+        return prop_value
+    return float( number_match.group( 1 ) )
+
+class TopologyIndex:
+    '''
+    Lookup tables for one parsed topology file (TopologyData), built once so nothing afterwards has to go back to the file:
+        * refDes <-> component id (the component id is also the node name in the nodal graph)
+        * component id -> properties, with the numeric values parsed into floats (see TypedPropertyValue())
+    The properties of a component are typed the first time they're looked up, so making an index for a big file costs next to nothing
+        when only a few of its components are ever queried.
+    The batch queries take lists of component ids, like the paths from tops_nodal_graph, and give back one value per component.
+    '''
+    def __init__( self, topology ):
+        self.topology_file = topology.topology_file
+        self.components = topology.components
+        self.refDes_to_comp = { component.refDes: comp_id for comp_id, component in self.components.items() if component.refDes is not None }
+        self.typed_props = {}
+
+    def TypedProps( self, comp_id ):
+        '''
+        { property: typed value } of a component, empty if it isn't in the file
+        '''
+        comp_props = self.typed_props.get( comp_id )
+        if comp_props is None:
+            component = self.components.get( comp_id )
+            comp_props = {} if component is None else { prop: TypedPropertyValue( prop_value ) for prop, prop_value in component.props.items() }
+            # two threads typing the same component just store the same values twice
+            self.typed_props[ comp_id ] = comp_props
+        return comp_props
+
+    def ComponentId( self, refDes ):
+        return self.refDes_to_comp.get( refDes )
+
+    def RefDes( self, comp_id ):
+        component = self.components.get( comp_id )
+        return component.refDes if component else None
+
+    def Properties( self, comp_id ):
+        return dict( self.TypedProps( comp_id ) )
+
+    def Property( self, comp_id, prop, default=None ):
+        return self.TypedProps( comp_id ).get( prop, default )
+
+    def PathRefDes( self, path ):
+        return [ self.RefDes( comp_id ) for comp_id in path ]
+
+    def PropertyValues( self, comp_ids, prop, default=None ):
+        '''
+        Value of prop for each component in comp_ids (default for components without it)
+        '''
+        return [ self.TypedProps( comp_id ).get( prop, default ) for comp_id in comp_ids ]
+
+    def PathProperties( self, paths, prop, default=None ):
+        '''
+        Value of prop for every component on every path: one list per path, lined up with the components on the path
+        '''
+        return [ self.PropertyValues( path, prop, default ) for path in paths ]
+
+    def PropertyTable( self, prop ):
+        '''
+        { component id: value } for every component that has prop
+        '''
+        return { comp_id: self.TypedProps( comp_id )[ prop ] for comp_id, component in self.components.items() if prop in component.props }
+
+def GetTopologyIndex( top_file=None ):
+    '''
+    Returns the TopologyIndex of a topology file (the current one by default), only building it again if the file was re-parsed
+    '''
+    with cache_lock:
+        topology = GetTopologyData( top_file )
+        file_key = os.path.abspath( topology.topology_file )
+        if file_key not in topology_indexes or topology_indexes[ file_key ][0] is not topology:
+            topology_indexes[ file_key ] = ( topology, TopologyIndex( topology ) )
+
+        return topology_indexes[ file_key ][1]
+
+def LookupComponent( node_name ):
+    return GetTopologyData().components.get( node_name )
+
 def LookupComponentType( node_name ):
-    CheckTopologyFileInitialized()
-    component_type = None
-
-    with open( topo_file , 'r' ) as top:
-        # lines = top.readlines()
-        # for line in lines:
-        while ( line := top.readline() ):
-            node_name_match = re.search( r'6624020A\.{0}" (\w+)'.format( node_name ), line )
-            if node_name_match:
-                component_type = node_name_match.group(1)
-        
-    return component_type
+    component = LookupComponent( node_name )
+    return component.comp_type if component else None
 
 def LookupRefDes( node_name ):
-    CheckTopologyFileInitialized()
-    name = None
-
-    with open( topo_file , 'r' ) as top:
-        while ( line := top.readline() ):
-            node_name_match = re.search( r'6624020A\.({0})"'.format( node_name ), line )
-            if node_name_match:
-                # skip to line with refDes
-                while ( 'refDes' not in (refDes_line := top.readline()) ): continue
-
-                name_match = re.search( r'refDes "([^"]+)"', refDes_line )
-                name = name_match.group(1)
-                break
-        
-    return name
+    component = LookupComponent( node_name )
+    return component.refDes if component else None
 
 def LookupTraceLength( trace ):
-    CheckTopologyFileInitialized()
-    trace_len = -1
-    with open( topo_file , 'r' ) as top:
-        while ( line := top.readline() ):
-            trace_name_match = re.search( r'6624020A\.({0})"'.format( trace ), line )
-            if trace_name_match:
-                while '(length "' not in ( trace_len_line := top.readline() ) : continue
-
-                trace_len_match = re.search( r'length "([0-9\.]+) MIL"', trace_len_line )
-                # print( trace_len_match.group(1) )
-                trace_len = float( trace_len_match.group(1) )
-    return trace_len
+    component = LookupComponent( trace )
+    return component.length if component and component.length is not None else -1
+
+def LookupTraceWidth( trace ):
+    component = LookupComponent( trace )
+    return component.width if component and component.width is not None else -1
 
 def LookupProperties( node_name ):
-    CheckTopologyFileInitialized()
-    props = {}
-
-    with open( topo_file , 'r' ) as top:
-        # lines = top.readlines()
-        # for line in lines:
-        while ( line := top.readline() ):
-            node_name_match = re.search( r'6624020A\.({0})"'.format( node_name ), line )
-            if node_name_match:
-                # skip lines until we reach properties
-                while 'Props' not in top.readline():
-                    continue
-                
-                end_props = False
-                while True:
-                    prop_line = top.readline()
-                    # print( prop_line )
-                    prop_match = re.search( r'(\w+) "([^"]+)"', prop_line )
-
-                    if prop_match:
-                        prop = prop_match.group(1)
-                        prop_value = prop_match.group(2)
-                        prop_digit = re.findall('\d*\.?\d+', prop_value )
-                        print( 'Property: ' + prop + ', digits: ', end='')
-                        print( prop_digit[0] )
-                        props[ prop ] = { True: prop_value , False: prop_digit[0] } [ len(prop_digit) < 1 ]
-                        # print( prop )
-                        # print( props[prop])
-                    else: #if property value regex does not match, then we're at the end of the properties for this node
-                        break
-                
-    return props
+    '''
+    Properties of a component in the current topology file, numeric values as floats (see TopologyIndex)
+    '''
+    return GetTopologyIndex().Properties( node_name )
@@ -0,0 +1,60 @@
+from collections import namedtuple
+
+import numpy as np
+
+import profiler
+
+# per path metrics, each field is an array with one entry per path
+PathMetricsData = namedtuple( 'PathMetricsData', 'etch_len via_count segment_count width_variance' )
+
+def ComponentTypeMask( graph, type_name ):
+    '''
+    Boolean array over component ids that is True for every component of type_name
+    '''
+    if type_name not in graph.component_type_names:
+        return np.zeros( len( graph.component_names ), dtype=bool )
+    return graph.component_types == graph.component_type_names.index( type_name )
+
+@profiler.Timed( 'metrics' )
+def PathMetrics( graph, paths ):
+    '''
+    Computes the metrics for every path (lists of component roots) in one vectorized pass:
+        * etch_len: sum of the trace segment lengths (MILs)
+        * via_count: number of vias
+        * segment_count: number of trace segments
+        * width_variance: variance of the trace widths along the path (MILs^2), NaN if no trace in the path has a width
+
+    All of the paths are flattened into one array of component ids with a matching array of path indexes,
+        so each metric is a single bincount over the whole set of paths instead of a loop per path.
+    '''
+    num_paths = len( paths )
+    if num_paths == 0:
+        empty = np.zeros( 0 )
+        return PathMetricsData( empty, empty.astype( np.int64 ), empty.astype( np.int64 ), empty )
+
+    path_sizes = np.fromiter( ( len( path ) for path in paths ), dtype=np.int64, count=num_paths )
+    path_index = np.repeat( np.arange( num_paths ), path_sizes )
+    path_components = np.fromiter( ( graph.component_ids[ component ] for path in paths for component in path ), dtype=np.int64, count=int( path_sizes.sum() ) )
+
+    def PathSum( per_component ):
+        return np.bincount( path_index, weights=per_component[ path_components ], minlength=num_paths )
+
+    is_trace = ComponentTypeMask( graph, 'Trace' )
+    is_via = ComponentTypeMask( graph, 'Via' )
+
+    has_width = is_trace & ~np.isnan( graph.component_widths )
+    widths = np.where( has_width, graph.component_widths, 0.0 )
+    num_widths = PathSum( has_width.astype( np.float64 ) )
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        mean_width = PathSum( widths ) / num_widths
+        # squared distance of every trace width from the mean width of its own path
+        width_deviation = np.where( has_width[ path_components ], widths[ path_components ] - mean_width[ path_index ], 0.0 )
+        width_variance = np.bincount( path_index, weights=width_deviation * width_deviation, minlength=num_paths ) / num_widths
+    width_variance = np.where( num_widths > 0, width_variance, np.nan )
+
+    return PathMetricsData(
+        etch_len=PathSum( graph.component_lengths ),
+        via_count=PathSum( is_via.astype( np.float64 ) ).astype( np.int64 ),
+        segment_count=PathSum( is_trace.astype( np.float64 ) ).astype( np.int64 ),
+        width_variance=width_variance,
+    )
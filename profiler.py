@@ -0,0 +1,90 @@
+import json
+import time
+import functools
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+
+class ProfileStats:
+    '''
+    Stage timers and counters for one run of the tool.
+
+    Everything is a no-op until Enable() is called, so the hooks can stay in the hot paths without slowing down normal runs.
+        * timers: stage name -> { 'seconds': total wall time, 'calls': number of times the stage ran }
+        * counters: counter name -> total ( "file_opens", "bytes_scanned", "search.nodes_expanded", "discarded.dni", ... )
+    Updates take a lock, so stages and counts from several threads (the query server) all add up.
+    '''
+    def __init__( self ):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.Reset()
+
+    def Reset( self ):
+        self.timers = defaultdict( lambda: { 'seconds': 0.0, 'calls': 0 } )
+        self.counters = defaultdict( int )
+
+    def Count( self, name, amount=1 ):
+        if self.enabled:
+            with self.lock:
+                self.counters[ name ] += amount
+
+    @contextmanager
+    def Stage( self, name ):
+        if not self.enabled:
+            yield
+            return
+
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            with self.lock:
+                timer = self.timers[ name ]
+                timer[ 'seconds' ] += elapsed
+                timer[ 'calls' ] += 1
+
+    def AsDict( self ):
+        with self.lock:
+            return {
+                'timers': { name: dict( timer ) for name, timer in self.timers.items() },
+                'counters': dict( self.counters ),
+            }
+
+    def Merge( self, stats_dict ):
+        '''
+        Adds in the stats from another process (the output of AsDict())
+        '''
+        with self.lock:
+            for name, timer in stats_dict[ 'timers' ].items():
+                self.timers[ name ][ 'seconds' ] += timer[ 'seconds' ]
+                self.timers[ name ][ 'calls' ] += timer[ 'calls' ]
+            for name, amount in stats_dict[ 'counters' ].items():
+                self.counters[ name ] += amount
+
+    def ToJSON( self ):
+        return json.dumps( self.AsDict(), indent=2, sort_keys=True )
+
+# stats for the current process
+stats = ProfileStats()
+
+def Enable():
+    stats.enabled = True
+
+def Disable():
+    stats.enabled = False
+
+def GetStats():
+    return stats
+
+def Timed( stage_name ):
+    '''
+    Decorator that times every call of a function as the stage_name stage
+    '''
+    def Decorator( func ):
+        @functools.wraps( func )
+        def TimedFunc( *args, **kwargs ):
+            with stats.Stage( stage_name ):
+                return func( *args, **kwargs )
+        return TimedFunc
+    return Decorator
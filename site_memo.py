@@ -0,0 +1,79 @@
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+from collections import namedtuple
+
+import profiler
+
+# the "_S<site>" suffix get_paths.AddSiteSuffix() puts on the refDes of every component of a repeated site
+SITE_SUFFIX_RE = re.compile( r'_S[0-9]+$' )
+
+# how many path search results the query server remembers before dropping the least recently used one
+DEFAULT_MAX_RESULTS = 256
+
+# hashes of a topology file that say whether two sites can share their path search results
+#   structure: the components (id, type, refDes without the site suffix) and the node listings, in file order.
+#       Two sites with the same structure have the same nodal graph, so they have the same paths (in the same order)
+#   geometry: the length and width of every component, in the same order.
+#       Two sites that also have the same geometry have the same path metrics, and the same shortest paths
+SiteKeys = namedtuple( 'SiteKeys', 'structure geometry' )
+
+# a search result kept by PathMemo, along with the geometry of the site it was searched on
+MemoizedPaths = namedtuple( 'MemoizedPaths', 'geometry all_paths' )
+
+def RemoveSiteSuffix( refDes ):
+    return SITE_SUFFIX_RE.sub( '', refDes ) if refDes else refDes
+
+def HashItems( items ):
+    sha = hashlib.sha1()
+    for item in items:
+        sha.update( repr( item ).encode( 'utf-8' ) )
+        sha.update( b'\n' )
+    return sha.hexdigest()
+
+@profiler.Timed( 'site_keys' )
+def TopologyKeys( topology ):
+    '''
+    SiteKeys for a parsed topology file (lookup_topo.TopologyData)
+    '''
+    components = topology.components.values()
+    structure = HashItems( [ ( c.comp_id, c.comp_type, RemoveSiteSuffix( c.refDes ) ) for c in components ] + [ tuple( terms ) for terms in topology.nodes ] )
+    geometry = HashItems( ( c.length, c.width ) for c in components )
+    return SiteKeys( structure, geometry )
+
+def SearchKey( site_keys, start, end, shortest=None, max_paths=None, max_length=None ):
+    '''
+    Two sites with the same search key get the same paths from get_paths.SearchPaths().
+    start and end can be component ids or refDes without the site suffix, as long as every key they're compared against uses the same.
+
+    Listing every path only depends on the structure, but the shortest paths and the paths under max_length depend on the trace lengths too.
+    '''
+    geometry = site_keys.geometry if shortest is not None or max_length is not None else None
+    return ( site_keys.structure, geometry, start, end, shortest, max_paths, max_length )
+
+class PathMemo:
+    '''
+    Search results of recent queries for the query server, keyed on SearchKey(), so a query repeated on the same site
+        or on any other site with the same structure skips the search.
+    Keys are built from the file contents, so a result never goes stale when a file changes, it just stops being looked up.
+    '''
+    def __init__( self, max_results=DEFAULT_MAX_RESULTS ):
+        self.max_results = max_results
+        self.results = OrderedDict()
+        self.lock = threading.Lock()
+
+    def Get( self, search_key ):
+        with self.lock:
+            memoized = self.results.get( search_key )
+            if memoized is not None:
+                self.results.move_to_end( search_key )
+        profiler.stats.Count( 'memo.misses' if memoized is None else 'memo.hits' )
+        return memoized
+
+    def Put( self, search_key, geometry, all_paths ):
+        with self.lock:
+            self.results[ search_key ] = MemoizedPaths( geometry, all_paths )
+            self.results.move_to_end( search_key )
+            while len( self.results ) > self.max_results:
+                self.results.popitem( last=False )
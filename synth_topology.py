@@ -0,0 +1,122 @@
+import random
+import argparse
+
+import lookup_topo as lt
+
+def ComponentEntry( comp_id, comp_type, refDes, length=None, width=None, props=None ):
+    entry = [ f'    ("{lt.DESIGN_PREFIX}.{comp_id}" {comp_type}', f'      (refDes "{refDes}")' ]
+    if length is not None:
+        entry.append( f'      (length "{length:.2f} MIL")' )
+    if width is not None:
+        entry.append( f'      (width "{width:.2f} MIL")' )
+    entry.append( '      (Props' )
+    for prop, prop_value in ( props or {} ).items():
+        entry.append( f'        ({prop} "{prop_value}")' )
+    entry.append( '      )' )
+    entry.append( '    )' )
+    return entry
+
+def GenerateTopology( num_segments, mesh_density=0.05, num_probes=2, via_ratio=0.1, max_junction_terms=3, site_num=1, seed=0, components_section=True,
+                      id_width=None, dni_ratio=0.0 ):
+    '''
+    Builds the text of a synthetic Allegro style topology file for benchmarking.
+
+    The net is a chain of num_segments trace segments (and vias) from a driver U1 to a receiver U2,
+        with num_probes probes hanging off junctions along the way.
+    mesh_density adds that fraction of num_segments as extra segments between random junctions of the chain,
+        which is what makes the number of paths between U1 and U2 grow.
+    No junction gets more than max_junction_terms terminals.
+    Every refDes except the probes gets the _S<site_num> suffix, like the files for repeated sites.
+    With components_section=False the component entries go straight in the Topology list instead of a Components section,
+        like some of the files Allegro writes.
+    id_width zero pads the number of every component id to that many digits ( "T007" ), so no id is part of another one
+        ( "T1" is part of "T10" ), which the string matching in GetValidPaths() needs to give the right answer.
+    dni_ratio is the fraction of segments that get a DNI refDes (see tops_nodal_graph.DNIList()).
+    '''
+    rng = random.Random( seed )
+    site_suffix = f'_S{site_num}'
+
+    def CompId( prefix, num ):
+        return f'{prefix}{num}' if id_width is None else f'{prefix}{num:0{id_width}d}'
+
+    entries = []
+    # junction -> terms in the node listing
+    junctions = [ [] for _ in range( num_segments + 1 ) ]
+
+    def AddSegment( seg_num, junction_a, junction_b ):
+        # drawn only when asked for, so the same seed still gives the same net without DNI segments
+        dni_prefix = 'NULL_' if dni_ratio and rng.random() < dni_ratio else ''
+        if rng.random() < via_ratio:
+            comp_id = CompId( 'V', seg_num )
+            entries.extend( ComponentEntry( comp_id, 'Via', f'{dni_prefix}VIA{seg_num}{site_suffix}', props={ 'PADSTACK': 'VIA8' } ) )
+        else:
+            comp_id = CompId( 'T', seg_num )
+            entries.extend( ComponentEntry( comp_id, 'Trace', f'{dni_prefix}T{seg_num}{site_suffix}',
+                                            length=rng.uniform( 5.0, 500.0 ), width=rng.choice( [ 3.5, 4.0, 5.0, 6.0 ] ),
+                                            props={ 'LAYER': rng.choice( [ 'TOP', 'L3', 'L5', 'BOTTOM' ] ) } ) )
+        junctions[ junction_a ].append( f'{comp_id}.1' )
+        junctions[ junction_b ].append( f'{comp_id}.2' )
+
+    driver, receiver = CompId( 'U', 1 ), CompId( 'U', 2 )
+    entries.extend( ComponentEntry( driver, 'IOCell', f'U1{site_suffix}', props={ 'PINUSE': 'OUT' } ) )
+    entries.extend( ComponentEntry( receiver, 'IOCell', f'U2{site_suffix}', props={ 'PINUSE': 'IN' } ) )
+    junctions[0].append( f'{driver}.1' )
+    junctions[ num_segments ].append( f'{receiver}.1' )
+
+    for seg_num in range( num_segments ):
+        AddSegment( seg_num + 1, seg_num, seg_num + 1 )
+
+    def OpenJunctions():
+        return [ j for j, terms in enumerate( junctions ) if len( terms ) < max_junction_terms ]
+
+    for probe_num in range( 1, num_probes + 1 ):
+        open_junctions = OpenJunctions()
+        if not open_junctions:
+            break
+        probe = CompId( 'P', probe_num )
+        entries.extend( ComponentEntry( probe, 'IOCell', f'PR{probe_num}', props={ 'PINUSE': 'UNSPEC' } ) )
+        junctions[ rng.choice( open_junctions ) ].append( f'{probe}.1' )
+
+    seg_num = num_segments
+    for _ in range( int( num_segments * mesh_density ) ):
+        open_junctions = OpenJunctions()
+        if len( open_junctions ) < 2:
+            break
+        junction_a, junction_b = sorted( rng.sample( open_junctions, 2 ) )
+        seg_num += 1
+        AddSegment( seg_num, junction_a, junction_b )
+
+    if components_section:
+        entries = [ '  (Components' ] + entries + [ '  )' ]
+    lines = [ f'(Topology "xnet_SYNTH_{site_num}"' ] + entries + [ '  (Nodes' ]
+    for junction_num, terms in enumerate( junctions, start = 1 ):
+        lines.append( f'    ("N{junction_num}"' )
+        lines.append( '      (terms ' + ' '.join( f'"{lt.DESIGN_PREFIX}.{term}"' for term in terms ) + ')' )
+        lines.append( '    )' )
+    lines += [ '  )', ')' ]
+    return '\n'.join( lines ) + '\n'
+
+def WriteTopologyFile( top_file, num_segments, **options ):
+    with open( top_file, 'w' ) as top:
+        top.write( GenerateTopology( num_segments, **options ) )
+    return top_file
+
+def main():
+    parser = argparse.ArgumentParser( description='Generate a synthetic topology file for benchmarking' )
+    parser.add_argument( 'output', help='Topology file to write, e.g. tops/xnet_SYNTH_1.top' )
+    parser.add_argument( '--segments', help='Number of trace segments in the main chain', type=int, default=1000 )
+    parser.add_argument( '--mesh', help='Extra segments between random junctions, as a fraction of --segments', type=float, default=0.05 )
+    parser.add_argument( '--probes', help='Number of probes on the net', type=int, default=2 )
+    parser.add_argument( '--junction-terms', help='Most terminals on one junction (node listing)', type=int, default=3 )
+    parser.add_argument( '--site', help='Site number used for the refDes suffixes', type=int, default=1 )
+    parser.add_argument( '--seed', help='Random seed', type=int, default=0 )
+    parser.add_argument( '--no-components-section', help='Put the component entries straight in the Topology list', action='store_true' )
+    parser.add_argument( '--id-width', help='Zero pad the component id numbers to this many digits', type=int, default=None )
+    parser.add_argument( '--dni', help='Fraction of segments that are DNI', type=float, default=0.0 )
+    args = parser.parse_args()
+
+    WriteTopologyFile( args.output, args.segments, mesh_density=args.mesh, num_probes=args.probes, max_junction_terms=args.junction_terms, site_num=args.site, seed=args.seed,
+                       components_section=not args.no_components_section, id_width=args.id_width, dni_ratio=args.dni )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import json
+import zipfile
+import hashlib
+import threading
+
+import numpy as np
+
+import tops_nodal_graph as tng
+import lookup_topo as lt
+import site_memo as sm
+import profiler
+
+# cache files are stored next to the topology files they were built from
+CACHE_FOLDER = '.topo_cache'
+
+# A cache file is a NumPy .npz archive. Anything that isn't an array is stored in it as JSON text, and it's read back
+#   with pickling turned off, so a cache file (in a tops directory that others can write to, say) can hold data but never run code.
+
+# bump this whenever the layout of the cached data (or what the parser reads from a file) changes so old cache files get rebuilt
+CACHE_VERSION = 10
+
+def FileHash( top_file ):
+    sha = hashlib.sha1()
+    with open( top_file, 'rb' ) as top:
+        while ( chunk := top.read( 1 << 20 ) ):
+            sha.update( chunk )
+    return sha.hexdigest()
+
+def CacheFilePath( top_file ):
+    top_dir, top_name = os.path.split( os.path.abspath( top_file ) )
+    return os.path.join( top_dir, CACHE_FOLDER, f'{top_name}.npz' )
+
+# CompactGraph fields that are lists of names rather than arrays (stored in the JSON text), the dicts are rebuilt from them
+GRAPH_NAME_FIELDS = [ 'node_names', 'component_names', 'component_type_names' ]
+GRAPH_ID_FIELDS = { 'node_ids': 'node_names', 'component_ids': 'component_names' }
+
+def GraphArrays( graph ):
+    '''
+    The arrays of a CompactGraph, as .npz entries named graph.<field>
+    '''
+    return { f'graph.{field}': getattr( graph, field ) for field in tng.CompactGraph._fields
+             if field not in GRAPH_NAME_FIELDS and field not in GRAPH_ID_FIELDS }
+
+def GraphFromArrays( info, arrays ):
+    fields = { field: info[ 'graph' ][ field ] for field in GRAPH_NAME_FIELDS }
+    for field, names_field in GRAPH_ID_FIELDS.items():
+        fields[ field ] = dict( zip( fields[ names_field ], range( len( fields[ names_field ] ) ) ) )
+    for field in tng.CompactGraph._fields:
+        if field not in fields:
+            fields[ field ] = arrays[ f'graph.{field}' ]
+    return tng.CompactGraph( **fields )
+
+def EntryArrays( cached ):
+    '''
+    The arrays of the .npz file for a cache entry (see LoadTopology())
+    '''
+    topology = cached[ 'topology' ]
+    info = {
+        'version': cached[ 'version' ],
+        'mtime': cached[ 'mtime' ],
+        'size': cached[ 'size' ],
+        'hash': cached[ 'hash' ],
+        'topology_file': topology.topology_file,
+        'components': [ list( component ) for component in topology.components.values() ],
+        'nodes': topology.nodes,
+        'node_names': topology.node_names,
+        'site_keys': list( cached[ 'site_keys' ] ),
+        'graph': { field: getattr( cached[ 'graph' ], field ) for field in GRAPH_NAME_FIELDS },
+    }
+    return { 'info': np.frombuffer( json.dumps( info ).encode( 'utf-8' ), dtype=np.uint8 ), **GraphArrays( cached[ 'graph' ] ) }
+
+def EntryFromArrays( arrays ):
+    '''
+    The cache entry stored in the arrays of a .npz file, None if it was written by another CACHE_VERSION
+    '''
+    info = json.loads( arrays[ 'info' ].tobytes().decode( 'utf-8' ) )
+    if not isinstance( info, dict ) or info.get( 'version' ) != CACHE_VERSION:
+        return None
+
+    components = { row[0]: lt.Component( *row ) for row in info[ 'components' ] }
+    return {
+        'version': info[ 'version' ],
+        'mtime': info[ 'mtime' ],
+        'size': info[ 'size' ],
+        'hash': info[ 'hash' ],
+        'topology': lt.TopologyData( info[ 'topology_file' ], components, info[ 'nodes' ], info[ 'node_names' ] ),
+        'site_keys': sm.SiteKeys( *info[ 'site_keys' ] ),
+        'graph': GraphFromArrays( info, arrays ),
+    }
+
+def ReadCache( cache_file ):
+    try:
+        with np.load( cache_file, allow_pickle=False ) as arrays:
+            return EntryFromArrays( arrays )
+    except ( OSError, EOFError, ValueError, KeyError, TypeError, zipfile.BadZipFile ):
+        # missing, cut short, or not a cache file at all ( ValueError: np.load() found something that would need pickle )
+        return None
+
+def WriteCache( cache_file, cached ):
+    '''
+    Writes a cache entry, returning False if it couldn't be written (read-only or shared tops directory, disk full, ...).
+    The cache only saves time, so a query never fails because of it.
+    '''
+    # write to a temp file first so an interrupted run never leaves a half written cache file behind
+    #   (one per thread, so two threads loading the same file don't write over each other's temp file)
+    temp_file = f'{cache_file}.{os.getpid()}.{threading.get_ident()}.tmp'
+    try:
+        os.makedirs( os.path.dirname( cache_file ), exist_ok=True )
+        with open( temp_file, 'wb' ) as cache:
+            np.savez( cache, **EntryArrays( cached ) )
+        os.replace( temp_file, cache_file )
+    except OSError:
+        profiler.stats.Count( 'cache.write_errors' )
+        try:
+            os.remove( temp_file )
+        except OSError:
+            pass
+        return False
+    return True
+
+def BuildCacheEntry( top_file, mtime, size, file_hash ):
+    # parsed straight from the file rather than through lookup_topo's module level cache, so loading is safe from any thread
+    topology = lt.ParseTopologyFile( top_file )
+
+    return {
+        'version': CACHE_VERSION,
+        'mtime': mtime,
+        'size': size,
+        'hash': file_hash,
+        'topology': topology,
+        'site_keys': sm.TopologyKeys( topology ),
+        'graph': tng.BuildCompactGraph( tng.BuildAdjList( topology ), topology.components ),
+    }
+
+@profiler.Timed( 'load_graph' )
+def LoadTopology( top_file ):
+    '''
+    Returns the cache entry for a topology file: a dict with its parsed 'topology', 'site_keys' (see site_memo.TopologyKeys()),
+        and the prebuilt tops_nodal_graph.CompactGraph 'graph' the path searches run on.
+    The adjacency list isn't part of the entry, the graph is all the path searches need (LoadAdjList() rebuilds it for the legacy scripts).
+
+    The cache file is trusted as long as the topology file's mtime and size haven't changed.
+    If they have, the content hash decides: same content just refreshes the stored mtime, different content rebuilds the cache.
+    '''
+    stat = os.stat( top_file )
+    cache_file = CacheFilePath( top_file )
+    cached = ReadCache( cache_file )
+
+    if cached is not None and ( cached[ 'mtime' ], cached[ 'size' ] ) != ( stat.st_mtime, stat.st_size ):
+        if cached[ 'hash' ] == FileHash( top_file ):
+            cached[ 'mtime' ] = stat.st_mtime
+            cached[ 'size' ] = stat.st_size
+            WriteCache( cache_file, cached )
+        else:
+            cached = None
+
+    profiler.stats.Count( 'cache.misses' if cached is None else 'cache.hits' )
+    if cached is None:
+        cached = BuildCacheEntry( top_file, stat.st_mtime, stat.st_size, FileHash( top_file ) )
+        WriteCache( cache_file, cached )
+    return cached
+
+def LoadAdjList( top_file ):
+    '''
+    Drop-in replacement for tops_nodal_graph.GetAdjList() that keeps the parsed topology file on disk (see LoadTopology()).
+
+    The refDes map and component table are loaded back into tops_nodal_graph and lookup_topo
+        so every lookup afterwards behaves exactly as if the file had just been parsed.
+    The adjacency list itself is rebuilt from the cached topology, that's cheap next to parsing the file.
+    '''
+    cached = LoadTopology( top_file )
+    topology = cached[ 'topology' ]
+    tng.refDes_to_compID_map.update( tng.RefDesMap( topology ) )
+    with lt.cache_lock:
+        lt.parsed_topologies[ os.path.abspath( top_file ) ] = ( cached[ 'mtime' ], topology )
+    return tng.BuildAdjList( topology )
+
+def LoadSiteKeys( top_file ):
+    '''
+    site_memo.SiteKeys of a topology file, from its cache entry
+    '''
+    return LoadTopology( top_file )[ 'site_keys' ]
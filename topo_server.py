@@ -0,0 +1,275 @@
+import os
+import json
+import math
+import threading
+from collections import OrderedDict
+from collections import namedtuple
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs, urlencode
+from urllib.request import urlopen
+from urllib.error import HTTPError, URLError
+
+import get_paths as gp
+import site_memo as sm
+import topology as tp
+
+DEFAULT_PORT = 8765
+
+# how many topology files stay loaded before the least recently used one is dropped
+DEFAULT_MAX_GRAPHS = 64
+
+# a loaded topology file (topology.Topology, which never changes once it's built) and the mtime and size it was loaded at
+LoadedTopology = namedtuple( 'LoadedTopology', 'topology_file mtime size topology' )
+
+class QueryError( Exception ):
+    '''
+    A query that can't be answered (missing parameters, unknown topology file or refDes), along with the HTTP status to send back
+    '''
+    def __init__( self, message, status=400 ):
+        super().__init__( message )
+        self.status = status
+
+class GraphCache:
+    '''
+    The most recently used topology files, loaded and ready to search, keyed on their absolute path.
+
+    A file is reloaded if its mtime or size changed since it was loaded, and once there are more than max_graphs files
+        the least recently used one is dropped.
+    Searches only read the Topology, so any number of them can run at once, and so can loads of different files.
+        Each file has its own load lock though, so a file that several requests need at once is only loaded by one of them.
+    '''
+    def __init__( self, max_graphs=DEFAULT_MAX_GRAPHS ):
+        self.max_graphs = max_graphs
+        self.graphs = OrderedDict()
+        self.lock = threading.Lock()
+        self.load_locks = {}
+
+    def LoadLock( self, topo_path ):
+        with self.lock:
+            return self.load_locks.setdefault( topo_path, threading.Lock() )
+
+    def Lookup( self, topo_path, stat ):
+        with self.lock:
+            loaded = self.graphs.get( topo_path )
+            if loaded is None or ( loaded.mtime, loaded.size ) != ( stat.st_mtime, stat.st_size ):
+                return None
+            self.graphs.move_to_end( topo_path )
+            return loaded
+
+    def Get( self, topo_file ):
+        topo_path = os.path.abspath( topo_file )
+        try:
+            stat = os.stat( topo_path )
+        except FileNotFoundError:
+            raise QueryError( f'Topology file "{os.path.basename( topo_file )}" cannot be found', status=404 )
+
+        loaded = self.Lookup( topo_path, stat )
+        if loaded is not None:
+            return loaded
+
+        with self.LoadLock( topo_path ):
+            # another request may have loaded the same file while this one was waiting
+            loaded = self.Lookup( topo_path, stat )
+            if loaded is not None:
+                return loaded
+
+            loaded = LoadedTopology( topo_path, stat.st_mtime, stat.st_size, tp.LoadTopology( topo_path ) )
+            with self.lock:
+                self.graphs[ topo_path ] = loaded
+                self.graphs.move_to_end( topo_path )
+                while len( self.graphs ) > self.max_graphs:
+                    self.graphs.popitem( last=False )
+        return loaded
+
+    def LoadedFiles( self ):
+        with self.lock:
+            return [ os.path.basename( topo_path ) for topo_path in self.graphs ]
+
+class TopologyServer:
+    '''
+    Answers path queries on the topology files in tops_dir, the same way get_paths.py would, from a GraphCache.
+    Search results are kept in a site_memo.PathMemo, so repeated queries (on the same site or a copy of it) skip the search.
+    '''
+    def __init__( self, tops_dir, max_graphs=DEFAULT_MAX_GRAPHS ):
+        self.tops_dir = os.path.abspath( tops_dir )
+        self.graphs = GraphCache( max_graphs )
+        self.memo = sm.PathMemo()
+
+    def TopologyFilePath( self, topo_file ):
+        # only files directly in the tops directory can be queried
+        if not topo_file or os.path.basename( topo_file ) != topo_file:
+            raise QueryError( f'"{topo_file}" is not a topology file name' )
+        return os.path.join( self.tops_dir, topo_file )
+
+    def Site( self, topo_file, start, end, add_site_suffix=False, **path_options ):
+        '''
+        Same as get_paths.ProcessSite(), except the paths also have their refDes filled in
+        '''
+        topology = self.graphs.Get( self.TopologyFilePath( topo_file ) ).topology
+        _, site_num = gp.GetSiteInfo( topo_file )
+
+        node_ends = []
+        for refDes in ( start, end ):
+            site_refDes = gp.AddSiteSuffix( refDes, site_num ) if add_site_suffix else refDes
+            node = topology.OriginNode( site_refDes )
+            if node is None:
+                raise QueryError( f'Node "{site_refDes}" is not in topology file "{topo_file}"', status=404 )
+            node_ends.append( node )
+
+        search_key = sm.SearchKey( topology.site_keys, node_ends[0], node_ends[1], **path_options )
+        memoized = self.memo.Get( search_key )
+        if memoized is None:
+            all_paths = gp.SearchPaths( topology.graph, node_ends[0], node_ends[1], **path_options )
+            self.memo.Put( search_key, topology.site_keys.geometry, all_paths )
+        elif memoized.geometry == topology.site_keys.geometry:
+            all_paths = memoized.all_paths
+        else:
+            all_paths = gp.MeasurePaths( topology.graph, [ path_data.node_path for path_data in memoized.all_paths ] )
+        all_paths = [ path_data._replace( refDes_path=topology.PathRefDes( path_data.node_path ) ) for path_data in all_paths ]
+        return gp.SiteData( site_num, topo_file, start, end, all_paths )
+
+    def Paths( self, params ):
+        site_data = self.Site( RequiredParam( params, 'net' ), RequiredParam( params, 'start' ), RequiredParam( params, 'end' ), **PathOptions( params ) )
+        return { 'sites': [ SiteDataToJSON( site_data ) ] }
+
+    def Batch( self, params ):
+        net_name = RequiredParam( params, 'net' )
+        site_files = gp.FindSiteFiles( net_name, self.tops_dir )
+        if not site_files:
+            raise QueryError( f'No topology files found for net "{net_name}"', status=404 )
+
+        start, end, path_options = RequiredParam( params, 'start' ), RequiredParam( params, 'end' ), PathOptions( params )
+        return { 'sites': [ SiteDataToJSON( self.Site( site_file, start, end, add_site_suffix=True, **path_options ) ) for site_file in site_files ] }
+
+    def AllPairs( self, params ):
+        topology = self.graphs.Get( self.TopologyFilePath( RequiredParam( params, 'net' ) ) ).topology
+        pair_lengths = topology.PathLengthMatrix( max_length=NumberParam( params, 'max_length', float ) )
+        pairs = []
+        for pair, ( num_paths, min_len, max_len ) in pair_lengths.items():
+            pair_start, pair_end = topology.PathRefDes( pair )
+            pairs.append( { 'start': pair_start, 'end': pair_end, 'paths': num_paths, 'min_length': min_len, 'max_length': max_len } )
+        return { 'pairs': pairs }
+
+    def Status( self, params ):
+        return { 'tops_dir': self.tops_dir, 'loaded': self.graphs.LoadedFiles() }
+
+def RequiredParam( params, name ):
+    if not params.get( name ):
+        raise QueryError( f'Missing query parameter "{name}"' )
+    return params[ name ]
+
+def NumberParam( params, name, number_type ):
+    if params.get( name ) is None:
+        return None
+    try:
+        return number_type( params[ name ] )
+    except ValueError:
+        raise QueryError( f'Query parameter "{name}" must be a number' )
+
+def PathOptions( params ):
+    return { 'shortest': NumberParam( params, 'k', int ), 'max_paths': NumberParam( params, 'max_paths', int ), 'max_length': NumberParam( params, 'max_length', float ) }
+
+def SiteDataToJSON( site_data ):
+    # JSON has no NaN, so a missing width variance goes out as null
+    return {
+        'site': site_data.site,
+        'topology_file': site_data.topology_file,
+        'start': site_data.start_node,
+        'end': site_data.end_node,
+        'paths': [ {
+            'path_num': path_data.path_num,
+            'node_path': path_data.node_path,
+            'refDes_path': path_data.refDes_path,
+            'etch_len': path_data.etch_len,
+            'via_count': path_data.via_count,
+            'segment_count': path_data.segment_count,
+            'width_variance': None if math.isnan( path_data.width_variance ) else path_data.width_variance,
+        } for path_data in site_data.all_paths ],
+    }
+
+def SiteDataFromJSON( site_json ):
+    all_paths = [ gp.PathData( path[ 'path_num' ], path[ 'node_path' ], path[ 'etch_len' ], path[ 'via_count' ], path[ 'segment_count' ],
+                               float( 'nan' ) if path[ 'width_variance' ] is None else path[ 'width_variance' ], path[ 'refDes_path' ] )
+                  for path in site_json[ 'paths' ] ]
+    return gp.SiteData( site_json[ 'site' ], site_json[ 'topology_file' ], site_json[ 'start' ], site_json[ 'end' ], all_paths )
+
+class QueryHandler( BaseHTTPRequestHandler ):
+    '''
+    GET /paths, /batch, /pairs or /status with the query in the URL parameters, answered with JSON
+    '''
+    def do_GET( self ):
+        url = urlparse( self.path )
+        params = { name: values[-1] for name, values in parse_qs( url.query ).items() }
+        topology_server = self.server.topology_server
+        queries = { '/paths': topology_server.Paths, '/batch': topology_server.Batch, '/pairs': topology_server.AllPairs, '/status': topology_server.Status }
+
+        try:
+            if url.path not in queries:
+                raise QueryError( f'Unknown query "{url.path}"', status=404 )
+            status, response = 200, queries[ url.path ]( params )
+        except QueryError as e:
+            status, response = e.status, { 'error': str( e ) }
+        except Exception as e:
+            status, response = 500, { 'error': f'{type( e ).__name__}: {e}' }
+
+        body = json.dumps( response ).encode( 'utf-8' )
+        self.send_response( status )
+        self.send_header( 'Content-Type', 'application/json' )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+def MakeServer( tops_dir, host='127.0.0.1', port=DEFAULT_PORT, max_graphs=DEFAULT_MAX_GRAPHS ):
+    server = ThreadingHTTPServer( ( host, port ), QueryHandler )
+    server.daemon_threads = True
+    server.topology_server = TopologyServer( tops_dir, max_graphs )
+    return server
+
+def Serve( tops_dir, host='127.0.0.1', port=DEFAULT_PORT, max_graphs=DEFAULT_MAX_GRAPHS ):
+    '''
+    Answers queries on the topology files in tops_dir until interrupted (Ctrl+C)
+    '''
+    if not os.path.isdir( tops_dir ):
+        print( f'The directory "{tops_dir}" cannot be found. Quitting...' )
+        quit()
+
+    server = MakeServer( tops_dir, host, port, max_graphs )
+    print( f'Serving topology files in {os.path.abspath( tops_dir )} at http://{host}:{server.server_address[1]}' )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def Query( server_url, query, **params ):
+    '''
+    Sends a query to a running server and returns the decoded JSON response, raising QueryError if it couldn't be answered
+    '''
+    params = { name: value for name, value in params.items() if value is not None }
+    url = f'{server_url.rstrip( "/" )}/{query}?{urlencode( params )}'
+    try:
+        with urlopen( url ) as response:
+            return json.load( response )
+    except HTTPError as e:
+        try:
+            message = json.load( e ).get( 'error', str( e ) )
+        except ValueError:
+            message = str( e )
+        raise QueryError( message, status=e.code )
+    except URLError as e:
+        raise QueryError( f'Could not reach the server at {server_url} ({e.reason})', status=None )
+
+def QuerySites( server_url, net, start, end, batch=False, shortest=None, max_paths=None, max_length=None ):
+    '''
+    get_paths.ProcessSite() (or every site of a net for batch) done by the server, as a list of SiteData
+    '''
+    response = Query( server_url, 'batch' if batch else 'paths', net=net, start=start, end=end, k=shortest, max_paths=max_paths, max_length=max_length )
+    return [ SiteDataFromJSON( site_json ) for site_json in response[ 'sites' ] ]
+
+def QueryAllPairs( server_url, net, max_length=None ):
+    '''
+    get_paths.ProcessAllPairs() done by the server
+    '''
+    response = Query( server_url, 'pairs', net=net, max_length=max_length )
+    return { ( pair[ 'start' ], pair[ 'end' ] ): ( pair[ 'paths' ], pair[ 'min_length' ], pair[ 'max_length' ] ) for pair in response[ 'pairs' ] }
@@ -0,0 +1,290 @@
+import os
+import re
+import mmap
+from collections import namedtuple
+
+import profiler
+
+# lengths and widths in other units are converted to MILs
+UNIT_TO_MIL = { b'MIL': 1.0, b'IN': 1000.0, b'MM': 1000.0 / 25.4, b'UM': 1.0 / 25.4 }
+
+# one component entry, with the design prefix taken off the component id ( "6624020A.T1" -> "T1" )
+# length and width are in MILs (None if not listed), props are the raw property strings
+ComponentRecord = namedtuple( 'ComponentRecord', 'comp_id comp_type refDes length width props' )
+
+# one entry of the Nodes section: the node name and its terminals, without the design prefix ( "6624020A.C1.1" -> "C1.1" )
+NodeRecord = namedtuple( 'NodeRecord', 'name terms' )
+
+# The patterns below run straight on the bytes of the memory mapped file, and are only compiled once.
+# Quoted strings are always matched whole, so the parentheses and whitespace inside them are never taken for list delimiters.
+#   Quoted strings can't span lines in a topology file.
+QUOTED = rb'"[^"\n]*"'
+# the text of a list up to its first "(" or ")", quoted strings included
+LIST_TEXT = rb'[^()"]*(?:' + QUOTED + rb'[^()"]*)*'
+# a list with no lists inside it: (refDes "T1"), (terms "6624020A.C1.1" "6624020A.T1.1")
+FLAT_LIST = rb'\(' + LIST_TEXT + rb'\)'
+FLAT_LISTS = rb'(?:' + FLAT_LIST + rb'\s*)*'
+BARE_WORD = rb'[^\s()"]+'
+
+# the next "(" or ")" (or quoted string, so it can be skipped)
+DELIMITER_RE = re.compile( rb'[()]|' + QUOTED )
+# the words at the start of a list, up to the first list inside it
+LIST_HEAD_RE = re.compile( rb'\((' + LIST_TEXT + rb')' )
+WORD_RE = re.compile( QUOTED + rb'|[^\s"]+' )
+# name and first value of a flat list, the value as ( text inside the quotes, bare word ): ( b'length', b'100.5 MIL', b'' )
+FIELD_RE = re.compile( rb'\(\s*(' + QUOTED + rb'|' + BARE_WORD + rb')\s*(?:"([^"\n]*)"|(' + BARE_WORD + rb'))?' + LIST_TEXT + rb'\)' )
+
+# Whole entries in the layout Allegro writes them in, matched in one go with their values captured,
+#   so Python only handles each entry once instead of once per list.
+# ( "6624020A.T1" Trace (refDes "T1") (length "100.5 MIL") (width "5.0 MIL") (Props (LAYER "TOP") ) )
+#   captures the id without its quotes and design prefix, the type, refDes, length, width, and the text of the Props items
+COMPONENT_ENTRY_RE = re.compile( rb'\(\s*"(?:[^"\n]*\.)?([^".\n]*)"\s+(' + BARE_WORD + rb')\s*'
+                                 rb'(?:\(refDes\s+"([^"\n]*)"\)\s*)?'
+                                 rb'(?:\(length\s+"([^"\n]*)"\)\s*)?'
+                                 rb'(?:\(width\s+"([^"\n]*)"\)\s*)?'
+                                 rb'(?:\(Props\s*(' + FLAT_LISTS + rb')\)\s*)?\)' )
+# any other component entry whose only list with lists inside it is one Props list, in one go as well
+#   captures the id (as above), the type, the text of the lists before Props, of the Props items, and of the lists after Props
+FLAT_COMPONENT_ENTRY_RE = re.compile( rb'\(\s*"(?:[^"\n]*\.)?([^".\n]*)"\s+(' + BARE_WORD + rb')\s*(' + FLAT_LISTS + rb')'
+                                      rb'(?:\(\s*Props\s*(' + FLAT_LISTS + rb')\)\s*)?(' + FLAT_LISTS + rb')\)' )
+# Anything else (more lists inside lists, a second Props, extra words in the header...) is read one list at a time.
+# ( "N1" (terms "6624020A.C1.1" "6624020A.T1.1") ), captures the name without its quotes and the text of the terms
+NODE_ENTRY_RE = re.compile( rb'\(\s*"([^"\n]*)"\s*\(\s*terms\s(' + LIST_TEXT + rb')\)\s*\)' )
+
+# section of the topology file whose entries are node listings
+NODES_SECTION = b'Nodes'
+
+def Text( token ):
+    return token.decode( 'utf-8', 'replace' )
+
+def Unquote( token ):
+    '''
+    The text of a quoted string token, bare words are returned as they are
+    '''
+    return token[ 1:-1 ] if token[ :1 ] == b'"' else token
+
+def StripDesignPrefix( name, num_parts ):
+    '''
+    The last num_parts "."-separated parts of name, which drops whatever design prefix Allegro put in front
+    '''
+    cut = len( name )
+    for _ in range( num_parts ):
+        cut = name.rfind( '.', 0, cut )
+        if cut == -1:
+            return name
+    return name[ cut+1: ]
+
+def ParseDistance( distance ):
+    '''
+    b"380.19 MIL" -> 380.19, None if it isn't a number with a known unit
+    '''
+    value, _, unit = distance.partition( b' ' )
+    try:
+        return float( value ) * UNIT_TO_MIL[ unit.strip().upper() or b'MIL' ]
+    except ( ValueError, KeyError ):
+        return None
+
+def IsComponentHeader( words ):
+    '''
+    True for the words at the start of a component entry: a quoted id then a bare type word ( "6624020A.T1" Trace ).
+    Component entries are found by their header wherever they are, some files list them in a Components section
+        and some put them straight in the Topology list.
+    '''
+    return len( words ) > 1 and words[0][ :1 ] == b'"' and words[1][ :1 ] != b'"'
+
+def ListField( words ):
+    '''
+    The words at the start of a list as a FIELD_RE match: ( name, text inside the quotes of the first value, first value if it's a bare word )
+    '''
+    value = words[1] if len( words ) > 1 else b''
+    return ( words[0], value[ 1:-1 ], b'' ) if value[ :1 ] == b'"' else ( words[0], b'', value )
+
+def PropsDict( props ):
+    '''
+    { name: value } from the fields (see FIELD_RE) of the items of a Props list, items without a value are skipped
+    '''
+    return { name.decode( 'utf-8', 'replace' ): ( quoted or bare ).decode( 'utf-8', 'replace' ) for name, quoted, bare in props if quoted or bare }
+
+def MatchedComponentRecord( match ):
+    '''
+    ComponentRecord for a COMPONENT_ENTRY_RE match
+    '''
+    comp_id, comp_type, refDes, length, width, props = match.groups()
+    # nearly every component goes through here, so the values are decoded inline rather than with Text()
+    return ComponentRecord( comp_id.decode( 'utf-8', 'replace' ), comp_type.decode( 'utf-8', 'replace' ),
+                            refDes.decode( 'utf-8', 'replace' ) if refDes else None,
+                            ParseDistance( length ) if length else None,
+                            ParseDistance( width ) if width else None,
+                            PropsDict( FIELD_RE.findall( props ) ) if props else {} )
+
+def BuildComponentRecord( comp_id, comp_type, fields, props ):
+    '''
+    ComponentRecord from the id (design prefix already taken off) and type of a component entry, the fields (see FIELD_RE)
+        of each list at the top of the entry in order, and the fields of the items of its Props list.
+    Only the first refDes, length, and width listed are used, lists without a value are skipped.
+    '''
+    refDes = length = width = None
+    for name, quoted, bare in fields:
+        value = quoted or bare
+        if not value:
+            continue
+        if name == b'refDes':
+            if refDes is None:
+                refDes = Text( value )
+        elif name == b'length':
+            if length is None:
+                length = ParseDistance( value )
+        elif name == b'width':
+            if width is None:
+                width = ParseDistance( value )
+    return ComponentRecord( comp_id, Text( comp_type ), refDes, length, width, PropsDict( props ) )
+
+def MatchedFlatComponentRecord( match ):
+    '''
+    ComponentRecord for a FLAT_COMPONENT_ENTRY_RE match
+    '''
+    comp_id, comp_type, fields, props, more_fields = match.groups()
+    fields = FIELD_RE.findall( fields )
+    # an empty (Props) before the one matched is the first Props, so the entry has no properties
+    if props is None or any( field[0] == b'Props' for field in fields ):
+        props = b''
+    if more_fields:
+        fields += FIELD_RE.findall( more_fields )
+    return BuildComponentRecord( Text( comp_id ), comp_type, fields, FIELD_RE.findall( props ) )
+
+def MakeComponentRecord( entry ):
+    '''
+    ComponentRecord for a component entry read one list at a time (see IterBufferRecords()), only the first Props list is used
+    '''
+    header = entry[0][1]
+    fields = []
+    props = []
+    seen_props = in_props = False
+    for depth, words in entry[ 1: ]:
+        if depth == 1:
+            in_props = False
+            if not words:
+                continue
+            if words[0] == b'Props':
+                in_props = not seen_props
+                seen_props = True
+            fields.append( ListField( words ) )
+        elif depth == 2 and in_props and words:
+            props.append( ListField( words ) )
+    return BuildComponentRecord( StripDesignPrefix( Text( Unquote( header[0] ) ), 1 ), Unquote( header[1] ), fields, props )
+
+def TermNames( terms ):
+    '''
+    Terminal names in the text of a (terms ...) list, without the design prefix ( "6624020A.C1.1" -> "C1.1", see StripDesignPrefix() ).
+    Terminal names never have spaces or parentheses in them, so all the quotes can come off at once
+    '''
+    return [ term[ term.rfind( '.', 0, term.rfind( '.' ) ) + 1: ] for term in terms.decode( 'utf-8', 'replace' ).replace( '"', '' ).split() ]
+
+def MatchedNodeRecord( match ):
+    '''
+    NodeRecord for a NODE_ENTRY_RE match
+    '''
+    name, terms = match.groups()
+    return NodeRecord( name.decode( 'utf-8', 'replace' ), TermNames( terms ) )
+
+def MakeNodeRecord( entry ):
+    '''
+    ( "N1" (terms "6624020A.C1.1" "6624020A.T1.1" ... ) ), read one list at a time
+    '''
+    header = entry[0][1]
+    if not header:
+        return None
+    terms = []
+    for depth, words in entry[ 1: ]:
+        if depth == 1 and words and words[0] == b'terms':
+            terms += TermNames( b' '.join( words[ 1: ] ) )
+    return NodeRecord( Text( Unquote( header[0] ) ), terms )
+
+def IterBufferRecords( buf ):
+    '''
+    Walks an s-expression buffer (bytes or an mmap) once, yielding a ComponentRecord for every component entry (see IsComponentHeader())
+        and a NodeRecord for every entry of the Nodes section.
+
+    Each entry in the usual layout is read with one match of COMPONENT_ENTRY_RE, FLAT_COMPONENT_ENTRY_RE, or NODE_ENTRY_RE. Any other entry is collected
+        one list at a time as ( depth inside the entry, words at the start of the list ) and turned into its record as soon as it's closed.
+    Either way nothing but the entry being read is kept, so memory use doesn't grow with the size of the file.
+    Words that come after a list inside another list ( the "d" in (a (b c) d) ) are skipped, topology files don't have any.
+    '''
+    # names of the lists open outside of an entry, outermost first
+    open_lists = []
+    # lists of the entry being read one list at a time (None when not in one), how deep in it the next list is, and the function that makes its record
+    entry = None
+    depth = 0
+    make_record = None
+
+    pos = 0
+    while True:
+        delimiter = DELIMITER_RE.search( buf, pos )
+        if delimiter is None:
+            break
+        start, pos = delimiter.span()
+        token = delimiter.group()
+
+        if token == b')':
+            if entry is not None:
+                depth -= 1
+                if depth == 0:
+                    record = make_record( entry )
+                    if record is not None:
+                        yield record
+                    entry = None
+            elif open_lists:
+                open_lists.pop()
+            continue
+        if token != b'(':
+            # a quoted string after a list inside another list
+            continue
+
+        if entry is None:
+            in_nodes = bool( open_lists ) and open_lists[-1] == NODES_SECTION
+            if in_nodes:
+                match = NODE_ENTRY_RE.match( buf, start )
+                if match is not None:
+                    yield MatchedNodeRecord( match )
+                    pos = match.end()
+                    continue
+            else:
+                match = COMPONENT_ENTRY_RE.match( buf, start )
+                if match is not None:
+                    yield MatchedComponentRecord( match )
+                    pos = match.end()
+                    continue
+                match = FLAT_COMPONENT_ENTRY_RE.match( buf, start )
+                if match is not None:
+                    yield MatchedFlatComponentRecord( match )
+                    pos = match.end()
+                    continue
+
+        head = LIST_HEAD_RE.match( buf, start )
+        pos = head.end()
+        words = WORD_RE.findall( head.group( 1 ) )
+
+        if entry is None:
+            if in_nodes:
+                entry, depth, make_record = [], 0, MakeNodeRecord
+            elif IsComponentHeader( words ):
+                entry, depth, make_record = [], 0, MakeComponentRecord
+
+        if entry is not None:
+            entry.append( ( depth, words ) )
+            depth += 1
+        else:
+            open_lists.append( words[0] if words else None )
+
+def IterRecords( top_file ):
+    '''
+    ComponentRecord and NodeRecord for every entry in a topology file, in file order.
+    The file is memory mapped, so it's never loaded into one Python string.
+    '''
+    profiler.stats.Count( 'file_opens' )
+    with open( top_file, 'rb' ) as top:
+        if os.fstat( top.fileno() ).st_size == 0:
+            return
+        with mmap.mmap( top.fileno(), 0, access=mmap.ACCESS_READ ) as buf:
+            profiler.stats.Count( 'bytes_scanned', len( buf ) )
+            yield from IterBufferRecords( buf )
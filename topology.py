@@ -0,0 +1,76 @@
+import tops_nodal_graph as tng
+import lookup_topo as lt
+import topo_cache as tc
+import site_memo as sm
+import path_metrics as pm
+
+class Topology:
+    '''
+    One topology file, parsed and turned into a graph, with everything a query on it needs:
+        * data: the parsed file (lookup_topo.TopologyData)
+        * index: refDes and property lookups (lookup_topo.TopologyIndex)
+        * graph: the nodal graph from tops_nodal_graph, as a CompactGraph (the adjacency list it was built from isn't kept)
+        * site_keys: the hashes site_memo uses to find copies of the site
+
+    Everything is built when the Topology is made and never changed afterwards, and none of it goes through the module level
+        "current topology file" in lookup_topo and tops_nodal_graph, so any number of threads can load and query
+        any number of topology files at once.
+    Nodes are named the same way as everywhere else ( "C1_ORIGIN" ), OriginNode() gives the one for a refDes.
+    '''
+    def __init__( self, data, site_keys=None, graph=None ):
+        self.topology_file = data.topology_file
+        self.data = data
+        self.index = lt.TopologyIndex( data )
+        self.graph = graph if graph is not None else tng.BuildCompactGraph( tng.BuildAdjList( data ), data.components )
+        self.site_keys = site_keys if site_keys is not None else sm.TopologyKeys( data )
+
+    def ComponentId( self, refDes ):
+        return self.index.ComponentId( refDes )
+
+    def RefDes( self, comp_id ):
+        return self.index.RefDes( comp_id )
+
+    def PathRefDes( self, path ):
+        return self.index.PathRefDes( path )
+
+    def Properties( self, comp_id ):
+        return self.index.Properties( comp_id )
+
+    def OriginNode( self, refDes ):
+        '''
+        Node the paths to and from a component start and end at ( "C1_ORIGIN" ), None if refDes isn't in the file
+        '''
+        comp_id = self.ComponentId( refDes )
+        return None if comp_id is None else f'{ comp_id }{ tng.RNS() }'
+
+    def IsDNI( self, comp_id ):
+        return tng.IsDNI( self.RefDes( comp_id ) )
+
+    def IterPaths( self, start_node, end_node, max_paths=None, max_length=None ):
+        return tng.IterPaths( self.graph, start_node, end_node, max_paths=max_paths, max_length=max_length )
+
+    def ShortestPaths( self, start_node, end_node, k=1, max_length=None ):
+        return tng.ShortestPaths( self.graph, start_node, end_node, k=k, max_length=max_length )
+
+    def EndpointComponents( self ):
+        return tng.EndpointComponents( self.graph )
+
+    def PathLengthMatrix( self, endpoints=None, max_length=None ):
+        return tng.PathLengthMatrix( self.graph, endpoints=endpoints, max_length=max_length )
+
+    def PathMetrics( self, paths ):
+        return pm.PathMetrics( self.graph, paths )
+
+def LoadTopology( top_file ):
+    '''
+    Topology of a topology file, from its cache entry (see topo_cache.LoadTopology()) so an unchanged file isn't parsed
+        or built into a graph again
+    '''
+    cached = tc.LoadTopology( top_file )
+    return Topology( cached[ 'topology' ], cached[ 'site_keys' ], cached[ 'graph' ] )
+
+def ParseTopology( top_file ):
+    '''
+    Topology of a topology file, parsed straight from the file without going through the cache
+    '''
+    return Topology( lt.ParseTopologyFile( top_file ) )
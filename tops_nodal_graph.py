@@ -1,12 +1,19 @@
 import re
 import os
+import heapq
+import threading
+from itertools import chain
 from collections import defaultdict
+from collections import namedtuple
 from enum import Enum
 
-from numpy.lib.function_base import append
+import numpy as np
 
 import lookup_topo as lt
+import profiler
 
+# refDes -> component id of every file read with GetAdjList(), all files in one map.
+#   Legacy state for the old single file scripts, it isn't thread-safe (use topology.Topology instead)
 refDes_to_compID_map = {}
 
 def DNIList():
@@ -19,6 +26,9 @@ def DNIList():
 
     return dni_list_generic.copy()
 
+def IsDNI( refDes ):
+    return refDes is not None and refDes.split('_')[0] in DNIList()
+
 def RNS():
     '''
     Returns the unique suffix string that specifies a node as the root node
@@ -26,15 +36,33 @@ def RNS():
     '''
     return '_ORIGIN'
 
-def GetNodeRoot( node_name ):
-    return node_name[:-7] if ( RNS() in node_name ) else node_name[:-2]
+def HNS():
+    '''
+    Returns the unique suffix string that specifies a node as the hub of a junction (a node listing with more than two terminals)
+    Hub Node Suffix (HNS)
+    '''
+    return '_HUB'
+
+def IsHub( node_name ):
+    return node_name.endswith( HNS() )
 
-def RefDesToNode( refDes ):
-    if refDes not in refDes_to_compID_map.keys():
+def GetNodeRoot( node_name ):
+    if RNS() in node_name:
+        return node_name[:-len( RNS() )]
+    if IsHub( node_name ):
+        return node_name[:-len( HNS() )]
+    # pin numbers can have more than one digit ( "U1.12" )
+    return node_name.rpartition( '.' )[0] or node_name
+
+def RefDesToNode( refDes, top_file=None ):
+    '''
+    Node (component id) for a refDes in a topology file (the current one by default), from the file's TopologyIndex
+    '''
+    node = lt.GetTopologyIndex( top_file ).ComponentId( refDes )
+    if node is None:
         print( f'Error: node "{refDes}" is not in this topology file. Quitting...' )
         quit()
-    else:
-        return refDes_to_compID_map[ refDes ]
+    return node
 
 def AddEdge( edge_list, edges ):
     edge1 = edges[0]
@@ -44,6 +72,28 @@ def AddEdge( edge_list, edges ):
     edge_list[edge2].append( edge1 )
 
 def GetAdjList( topo_file ):
+    '''
+    Nodal graph of a topology file (see BuildAdjList()), parsed through lookup_topo's cache.
+    Also adds the file's components to refDes_to_compID_map for RefDesToNode()
+    '''
+    topology = lt.GetTopologyData( topo_file )
+    refDes_to_compID_map.update( RefDesMap( topology ) )
+    return BuildAdjList( topology )
+
+def RefDesMap( topology ):
+    '''
+    { refDes: component id } for every component with a terminal in the Nodes listing of a parsed topology file
+    '''
+    refDes_map = {}
+    for edge in topology.nodes:
+        for node in edge:
+            node_root = GetNodeRoot( node )
+            component = topology.components.get( node_root )
+            refDes_map[ component.refDes if component else None ] = node_root
+    return refDes_map
+
+@profiler.Timed( 'adj_list' )
+def BuildAdjList( topology ):
     '''
     Each topology file has a Nodes List, which shows the connections between all of the components in the topology file.
     
@@ -83,67 +133,43 @@ def GetAdjList( topo_file ):
             ( C1_ORIGIN ) that is connected to both C1.1 and C1.2
         * This approach makes the appropriate node connections, while adding some redundant or unecessary node connections
             which need to be filtered out later when plotting all possible paths between two nodes.
+
+    A node listing with more than two terminals (a junction, like a T or a star on a fan-out net) gets its own hub node
+        named after the listing ( "node1_HUB" ), connected to every terminal in it.
+        * Connecting the terminals to each other directly instead would take a connection for every pair of terminals,
+            which adds up fast on heavily branched nets.
+        * Hub nodes are never part of a path, the terminals on either side of one are just connected.
     '''
     edges = defaultdict(list)
 
-    # save the topology file currently set in the lookup_topo API in case it's different than the topology file passed in
-    save_topo_file = lt.GetTopologyFile()
-    lt.SetTopologyFile( topo_file )
-
-    with open( topo_file , 'r' ) as top:
-        while ( skipline := top.readline() ):
-            # skip lines to nodal graph
-            if 'Nodes' in skipline:
-                while ')' not in ( top.readline() ): # ends with closing paren for nodes section
-                    line_with_edges = top.readline()
-                    edge = re.findall( r'\.([^"]+)', line_with_edges )
-
-                    for node in edge:
-                        node_root = GetNodeRoot( node )
-                        refDes_to_compID_map[ lt.LookupRefDes( node_root ) ] = node_root 
-                        # print( f'node name: {node} | refDes: {lt.LookupRefDes(topo_file, node[:-2] )}' )
-
-                    # handle case in topology file when only one node is in the listing
-                    if len( edge ) == 1:
-                        edges[ edge[0] ]
-
-                    if len( edge ) == 2:
-                        AddEdge( edges, edge )
-
-                    # TODO: write function to handle edges greater than 3
-                    # break one edge with 3 nodes into 3 edges with 2
-                    if len( edge ) == 3:
-                        edge1 = [ edge[0], edge[1] ]
-                        edge2 = [ edge[1], edge[2] ]
-                        edge3 = [ edge[0], edge[2] ]
-                        AddEdge( edge_list = edges, edges = edge1 )
-                        AddEdge( edge_list = edges, edges = edge2 )
-                        AddEdge( edge_list = edges, edges = edge3 )
-
-                    # next line is closing paren for current node (skip it)
-                    top.readline()
-    
-    component_suffix_int_count = defaultdict(int)
+    for node_name, edge in zip( topology.node_names, topology.nodes ):
+        # handle case in topology file when only one node is in the listing
+        if len( edge ) == 1:
+            edges[ edge[0] ]
 
-    # figure out how many different suffix integers there are for each component
-    for node in edges.keys():
-        component_root = GetNodeRoot( node )
-        component_origin = f'{ component_root }{ RNS() }' # Using [:-2] to trim off the .# substring first
+        if len( edge ) == 2:
+            AddEdge( edges, edge )
 
-        component_suffix_int_count[ component_origin ] = component_suffix_int_count[ component_origin ] + 1
+        if len( edge ) > 2:
+            hub = f'{ node_name }{ HNS() }'
+            # node names should be unique, but two listings with the same name still shouldn't end up as one junction
+            if hub in edges:
+                hub = f'{ node_name }.{ len( edges ) }{ HNS() }'
+            for node in edge:
+                AddEdge( edge_list = edges, edges = [ hub, node ] )
 
-        # For all component nodes with suffix integers, add connection to _ORIGIN node 
-        edges[node].append( component_origin )
-    
-    # Add connection from _ORIGIN node to all component nodes with suffix integers
-    for component_origin in component_suffix_int_count.keys():
-        edges[ component_origin ] = []
-        for i in range( 1, component_suffix_int_count[component_origin] + 1 ): # +1 because python range() function is exclusive at the end
-            component_root = GetNodeRoot( component_origin )
-            edges[ component_origin ].append( f'{ component_root }.{ i }') # trim off '_ORIGIN' substring with [:-7]
+    # every pin of each component, in the order they were first seen
+    component_pins = defaultdict(list)
+    for node in edges.keys():
+        if not IsHub( node ):
+            component_pins[ f'{ GetNodeRoot( node ) }{ RNS() }' ].append( node )
 
-    # restore topology file for lookup api in case it was a different one
-    lt.SetTopologyFile( save_topo_file )
+    # connect each pin to its component's _ORIGIN node and back
+    #   (the pins actually listed, rather than assuming they're numbered 1 to the pin count)
+    for component_origin, pins in component_pins.items():
+        for node in pins:
+            edges[ node ].append( component_origin )
+        edges[ component_origin ] = pins.copy()
 
     return edges
 
@@ -152,23 +178,33 @@ def PrintAdjList( adj_list ):
         # print( f'{lt.LookupRefDes( tng.GetNodeRoot(key) )}: {[lt.LookupRefDes( tng.GetNodeRoot(x) ) for x in val]}' )
         print( f'{key}: {val}')
 
-connectionPath = []
-connectionPaths = []
+# paths found by the last FindAllPaths() in each thread, for ConnectionPaths()
+last_search = threading.local()
 
 def FindAllPaths( adj_list, start_node, dest_node ):
     '''
-    Uses DFS to find all the paths between the starting node and ending node
+    Uses DFS to find all the paths between the starting node and ending node, and returns them.
+    The path being built only lives for one call, so nothing is left over from a previous search (even one that failed part way).
     '''
-    for next_node in adj_list[ start_node ]:
-        if ( next_node == dest_node ):
-            temp_path = []
-            for n in connectionPath:
-                temp_path.append( n )
-            connectionPaths.append( temp_path )
-        elif next_node not in connectionPath:
-            connectionPath.append( next_node )
-            FindAllPaths( adj_list, next_node, dest_node )
-            connectionPath.pop()
+    connectionPath = []
+    connectionPaths = []
+
+    def Search( node ):
+        profiler.stats.Count( 'legacy.nodes_expanded' )
+        for next_node in adj_list[ node ]:
+            if ( next_node == dest_node ):
+                connectionPaths.append( connectionPath.copy() )
+            elif IsHub( next_node ):
+                # hubs are left out of the path, the pins on either side of one are just connected
+                Search( next_node )
+            elif next_node not in connectionPath:
+                connectionPath.append( next_node )
+                Search( next_node )
+                connectionPath.pop()
+
+    Search( start_node )
+    last_search.connectionPaths = connectionPaths
+    return connectionPaths.copy()
 
 def GetValidPaths( all_paths, start_node, end_node ):
     valid_paths = all_paths.copy()
@@ -186,6 +222,7 @@ def GetValidPaths( all_paths, start_node, end_node ):
             # print( path )
             # print( 'removing...')
             valid_paths.remove( path )
+            profiler.stats.Count( 'discarded.start_end_origin' )
 
     # Remove paths that have a pass by the end node by the L/R node instead
     remaining_paths = valid_paths.copy()
@@ -194,6 +231,7 @@ def GetValidPaths( all_paths, start_node, end_node ):
         end_node_root = GetNodeRoot( end_node )
         if path_to_combined_string.count( end_node_root ) > 1:
             valid_paths.remove( path )
+            profiler.stats.Count( 'discarded.through_end_pin' )
 
     # Remove nodes that have just one L/R node instead of passing through the ORIGIN of the component
     remaining_paths = valid_paths.copy()
@@ -205,6 +243,7 @@ def GetValidPaths( all_paths, start_node, end_node ):
             # print( f'inspecting node: {node}, with node root: {node_root}')
             if node_root not in [ start_node_root, end_node_root ] and path_to_combined_string.count( node_root ) < 3:
                 valid_paths.remove( path )
+                profiler.stats.Count( 'discarded.skipped_origin' )
                 break
 
 
@@ -230,31 +269,425 @@ def RemoveDNIPaths( nodal_paths ):
     remaining_paths = non_dni_paths.copy()
     for path in remaining_paths:
         for node in path:
-            node_refDes = lt.LookupRefDes( node )
-            node_refDes_no_suffix = node_refDes.split('_')[0]
-            if node_refDes_no_suffix in DNIList():
+            if IsDNI( lt.LookupRefDes( node ) ):
                 # print( f'found invalid path with DNI: {node_refDes}')
                 non_dni_paths.remove( path )
+                profiler.stats.Count( 'discarded.dni' )
+                # the path is gone, another DNI component on it can't remove it again
+                break
     
     return non_dni_paths
 
+# Integer indexed version of the adjacency list from GetAdjList(), built by BuildCompactGraph().
+# Adjacency is stored CSR style: the entries for id i are indices[ offsets[i]:offsets[i+1] ]
+CompactGraph = namedtuple( 'CompactGraph', [
+    'node_names',           # node id -> node name ( "C1.1", "C1_ORIGIN" )
+    'node_ids',             # node name -> node id
+    'adj_offsets',          # node id -> neighboring node ids (the full pin/_ORIGIN adjacency list)
+    'adj_indices',
+    'node_component',       # node id -> component id of the node's root
+    'component_names',      # component id -> component root ( "C1" )
+    'component_ids',        # component root -> component id
+    'component_type_names', # type code -> component type ( "Trace", "Via", ... )
+    'component_types',      # component id -> type code
+    'component_lengths',    # component id -> etch length it adds to a path in MILs (only traces have a length)
+    'component_widths',     # component id -> trace width in MILs (NaN for anything without a width)
+    'component_dni',        # component id -> True if the component is DNI
+    'pin_offsets',          # component id -> node ids of its pins (LR nodes)
+    'pin_indices',
+    'link_offsets',         # node id -> node ids of the pins of other components it is connected to directly (two terminal nodes)
+    'link_indices',
+    'pin_hub_offsets',      # node id -> node ids of the hubs of the junctions the pin is on
+    'pin_hub_indices',
+    'hub_pin_offsets',      # node id of a hub -> node ids of the pins on its junction
+    'hub_pin_indices',
+] )
+
+def CSRArrays( rows ):
+    '''
+    Packs a list of lists of ints into ( offsets, indices ) arrays
+    '''
+    offsets = np.zeros( len( rows ) + 1, dtype=np.int64 )
+    offsets[1:] = np.cumsum( np.fromiter( map( len, rows ), dtype=np.int64, count=len( rows ) ) )
+    indices = np.fromiter( chain.from_iterable( rows ), dtype=np.int32, count=int( offsets[-1] ) )
+    return offsets, indices
+
+def CSRRow( offsets, indices, i ):
+    return indices[ offsets[i]:offsets[i+1] ]
+
+@profiler.Timed( 'compact_graph' )
+def BuildCompactGraph( adj_list, components ):
+    '''
+    Interns every node name and component root of the adjacency list to an integer id and packs the graph into NumPy arrays.
+
+    Component types, trace lengths and widths, and DNI flags are looked up once per component in components (the component table
+        of the TopologyData the adjacency list was built from) and stored per component id,
+        so the path searches never touch strings or the component table again.
+    The pin -> pin links are the pin/_ORIGIN graph collapsed down to what the path searches actually need:
+        the pins of other components each pin is connected to at a node.
+    Junctions stay as hubs (pin -> hub -> pin) so the arrays grow with the number of terminals, not the number of pairs of them.
+        Hubs get node ids but no component (their node_component is -1).
+    Everything is collected in plain lists and turned into arrays once at the end, since setting or reading NumPy arrays
+        one element at a time from Python is slower than doing the same with lists.
+    '''
+    # node ids in the order the nodes first show up: each node of the adjacency list, then its neighbors
+    node_names = list( dict.fromkeys( chain.from_iterable( chain( ( node, ), neighbors ) for node, neighbors in adj_list.items() ) ) )
+    node_ids = dict( zip( node_names, range( len( node_names ) ) ) )
+
+    # GetNodeRoot() and IsHub() for every node, written out so there's no function call per node
+    hub_suffix, origin_suffix = HNS(), RNS()
+    is_hub = [ node.endswith( hub_suffix ) for node in node_names ]
+    is_origin = [ origin_suffix in node for node in node_names ]
+    node_roots = [ None if hub else node[ :-len( origin_suffix ) ] if origin else ( node.rpartition( '.' )[0] or node )
+                   for node, hub, origin in zip( node_names, is_hub, is_origin ) ]
+    component_ids = {}
+    node_component = [ -1 if root is None else component_ids.setdefault( root, len( component_ids ) ) for root in node_roots ]
+    component_names = list( component_ids.keys() )
+
+    component_type_ids = {}
+    component_types = []
+    component_lengths = []
+    component_widths = []
+    component_dni = []
+    # traces without a usable length (missing, or in a unit ParseDistance() doesn't know)
+    unknown_lengths = []
+    for component_name in component_names:
+        component = components.get( component_name )
+        if component is None:
+            component_types.append( component_type_ids.setdefault( None, len( component_type_ids ) ) )
+            component_lengths.append( 0.0 )
+            component_widths.append( np.nan )
+            component_dni.append( False )
+            continue
+        component_types.append( component_type_ids.setdefault( component.comp_type, len( component_type_ids ) ) )
+        # same as ComponentLength(): only trace segments have a length.
+        #   A trace without one counts as 0, the shortest path and max length searches rely on lengths never being negative
+        length = 0.0
+        if component.comp_type == 'Trace':
+            if component.length is None or component.length < 0:
+                unknown_lengths.append( component_name )
+            else:
+                length = component.length
+        component_lengths.append( length )
+        component_widths.append( component.width if component.width is not None and component.width >= 0 else np.nan )
+        component_dni.append( IsDNI( component.refDes ) )
+
+    if unknown_lengths:
+        profiler.stats.Count( 'unknown_trace_lengths', len( unknown_lengths ) )
+        print( f'Warning: {len( unknown_lengths )} trace segment(s) have no length that can be read ({", ".join( unknown_lengths[ :5 ] )}{", ..." if len( unknown_lengths ) > 5 else ""}), counting them as 0 MILs' )
+
+    adj_rows = [ [] for _ in node_names ]
+    component_pins = [ [] for _ in component_names ]
+    pin_links = [ [] for _ in node_names ]
+    pin_hubs = [ [] for _ in node_names ]
+    hub_pins = [ [] for _ in node_names ]
+    for node, neighbors in adj_list.items():
+        node_id = node_ids[ node ]
+        row = adj_rows[ node_id ] = [ node_ids[ neighbor ] for neighbor in neighbors ]
+        if is_hub[ node_id ]:
+            hub_pins[ node_id ] = row
+            continue
+        if is_origin[ node_id ]:
+            continue
+        component_id = node_component[ node_id ]
+        component_pins[ component_id ].append( node_id )
+        pin_links[ node_id ] = [ n for n in row if not is_origin[n] and not is_hub[n] and node_component[n] != component_id ]
+        pin_hubs[ node_id ] = [ n for n in row if is_hub[n] ]
+
+    adj_offsets, adj_indices = CSRArrays( adj_rows )
+    pin_offsets, pin_indices = CSRArrays( component_pins )
+    link_offsets, link_indices = CSRArrays( pin_links )
+    pin_hub_offsets, pin_hub_indices = CSRArrays( pin_hubs )
+    hub_pin_offsets, hub_pin_indices = CSRArrays( hub_pins )
+
+    return CompactGraph( node_names, node_ids, adj_offsets, adj_indices, np.array( node_component, dtype=np.int32 ),
+                         component_names, component_ids, list( component_type_ids.keys() ), np.array( component_types, dtype=np.int16 ),
+                         np.array( component_lengths, dtype=np.float64 ), np.array( component_widths, dtype=np.float64 ),
+                         np.array( component_dni, dtype=bool ), pin_offsets, pin_indices, link_offsets, link_indices,
+                         pin_hub_offsets, pin_hub_indices, hub_pin_offsets, hub_pin_indices )
+
+def AsCompactGraph( graph ):
+    '''
+    Lets every path search take either the adjacency list from GetAdjList() or an already built CompactGraph.
+    An adjacency list is built into a graph with the components of the topology file currently set in lookup_topo,
+        which isn't thread-safe, anything that searches more than one file at once has to pass CompactGraphs.
+    '''
+    if isinstance( graph, CompactGraph ):
+        return graph
+    if not lt.GetTopologyFile():
+        raise ValueError( 'No topology file is set for the adjacency list, build a CompactGraph with BuildCompactGraph( adj_list, components ) instead' )
+    return BuildCompactGraph( graph, lt.GetTopologyData().components )
+
+def ComponentId( graph, node ):
+    '''
+    Component id for a component root, or for a node name ( "C1.1", "C1_ORIGIN" ). None if it isn't in the graph
+    '''
+    return graph.component_ids[ node ] if node in graph.component_ids else graph.component_ids.get( GetNodeRoot( node ) )
+
+def ExitPinsFunction( graph ):
+    '''
+    Returns ExitPins( component id, entry pin id ): the pins of other components reachable by leaving the component
+        through any pin other than the one it was entered on, either directly or through a junction's hub.
+    The CSR arrays are copied to lists once up front since indexing NumPy arrays one element at a time is slow.
+    '''
+    node_component = graph.node_component.tolist()
+    pin_offsets = graph.pin_offsets.tolist()
+    pin_indices = graph.pin_indices.tolist()
+    link_offsets = graph.link_offsets.tolist()
+    link_indices = graph.link_indices.tolist()
+    pin_hub_offsets = graph.pin_hub_offsets.tolist()
+    pin_hub_indices = graph.pin_hub_indices.tolist()
+    hub_pin_offsets = graph.hub_pin_offsets.tolist()
+    hub_pin_indices = graph.hub_pin_indices.tolist()
+
+    def ExitPins( component, entry_pin ):
+        for pin in pin_indices[ pin_offsets[ component ]:pin_offsets[ component+1 ] ]:
+            if pin != entry_pin:
+                yield from link_indices[ link_offsets[ pin ]:link_offsets[ pin+1 ] ]
+                for hub in pin_hub_indices[ pin_hub_offsets[ pin ]:pin_hub_offsets[ pin+1 ] ]:
+                    for hub_pin in hub_pin_indices[ hub_pin_offsets[ hub ]:hub_pin_offsets[ hub+1 ] ]:
+                        if node_component[ hub_pin ] != component:
+                            yield hub_pin
+
+    return ExitPins
+
+def ComponentLength( component ):
+    '''
+    Etch length a component adds to a path in MILs (only trace segments have a length, a trace without one counts as 0)
+    '''
+    return max( 0, lt.LookupTraceLength( component ) ) if lt.LookupComponentType( component ) == 'Trace' else 0
+
+def CompactPathLength( graph, path ):
+    '''
+    Etch length of a path of component roots, summed straight from the component length array
+    '''
+    return float( graph.component_lengths[ [ graph.component_ids[ component ] for component in path ] ].sum() )
+
+def WalkPathsToTargets( adj_list, start_node, target_components, max_length=None, stop_at_targets=True ):
+    '''
+    Depth first search over components (not pins) that only ever builds valid paths, yielding ( target, path, etch length )
+        every time the path reaches one of target_components (component roots).
+
+    The rules GetValidPaths() and RemoveDNIPaths() apply after the fact are applied while searching instead:
+        * every component in between the start and end has to be passed through its _ORIGIN,
+            so it is entered on one pin and left on a different pin (a component with one pin is a dead end)
+        * no component shows up in a path twice (including the start component)
+        * DNI components are never entered
+    With stop_at_targets the search ends a path at a target. Otherwise it keeps going through the target (by the same rules
+        as any other component), so one search finds the paths from the start to every target at once.
+    The yielded paths are lists of component roots, the same form RemoveLRNodes() produces.
+    Only the current path is held in memory, so the search doesn't blow up on meshed nets before any filtering happens.
+
+    If max_length is given, a branch is dropped as soon as its etch length goes over max_length (MILs),
+        since adding more components to it can only make it longer.
+
+    adj_list can also be a CompactGraph; the search itself runs entirely on its integer ids.
+    '''
+    graph = AsCompactGraph( adj_list )
+    ExitPins = ExitPinsFunction( graph )
+    node_component = graph.node_component.tolist()
+    component_lengths = graph.component_lengths.tolist()
+    component_dni = graph.component_dni.tolist()
+    component_names = graph.component_names
+
+    start_component = ComponentId( graph, start_node )
+    target_ids = { graph.component_ids[ target ] for target in target_components if target in graph.component_ids }
+    if start_component is None:
+        return
+
+    path = [ start_component ]
+    on_path = { start_component }
+    # running etch length of the path, one entry per component in the path
+    path_lengths = [ component_lengths[ start_component ] ]
+    # one iterator per component in the path, over the pins it can be left through
+    search_stack = [ ExitPins( start_component, None ) ]
+
+    # kept in locals and only handed to the profiler at the end, so counting costs next to nothing in the search loop
+    nodes_expanded = paths_found = discarded_revisit = discarded_length = discarded_dni = 0
+    try:
+        while search_stack:
+            next_pin = next( search_stack[-1], None )
+            if next_pin is None:
+                search_stack.pop()
+                on_path.discard( path.pop() )
+                path_lengths.pop()
+                continue
+
+            next_component = node_component[ next_pin ]
+            if next_component in on_path:
+                discarded_revisit += 1
+                continue
+
+            next_length = path_lengths[-1] + component_lengths[ next_component ]
+            if max_length is not None and next_length > max_length:
+                discarded_length += 1
+                continue
+
+            if next_component in target_ids:
+                paths_found += 1
+                yield component_names[ next_component ], [ component_names[ c ] for c in path ] + [ component_names[ next_component ] ], next_length
+                if stop_at_targets:
+                    continue
+
+            if component_dni[ next_component ]:
+                discarded_dni += 1
+                continue
+
+            nodes_expanded += 1
+            path.append( next_component )
+            on_path.add( next_component )
+            path_lengths.append( next_length )
+            search_stack.append( ExitPins( next_component, next_pin ) )
+    finally:
+        profiler.stats.Count( 'search.nodes_expanded', nodes_expanded )
+        profiler.stats.Count( 'search.paths_found', paths_found )
+        profiler.stats.Count( 'discarded.revisit', discarded_revisit )
+        profiler.stats.Count( 'discarded.max_length', discarded_length )
+        profiler.stats.Count( 'discarded.dni', discarded_dni )
+
+def WalkValidPaths( adj_list, start_node, end_node, max_length=None ):
+    '''
+    Yields ( path, etch length ) for every valid path from start_node to end_node (see WalkPathsToTargets()).
+    The search stops at the end component, it is never passed through on the way to somewhere else.
+    '''
+    for _, path, path_length in WalkPathsToTargets( adj_list, start_node, { GetNodeRoot( end_node ) }, max_length ):
+        yield path, path_length
+
+def EndpointComponents( adj_list ):
+    '''
+    Every component that can be the start or end of a path (drivers, receivers, probes, resistors, etc.),
+        which is everything except trace segments, vias, and DNI components
+    '''
+    graph = AsCompactGraph( adj_list )
+    has_pins = np.diff( graph.pin_offsets ) > 0
+    not_routing = ~np.isin( graph.component_types, [ code for code, type_name in enumerate( graph.component_type_names ) if type_name in ( 'Trace', 'Via' ) ] )
+    return [ graph.component_names[ c ] for c in np.flatnonzero( has_pins & not_routing & ~graph.component_dni ) ]
+
+@profiler.Timed( 'all_pairs' )
+def PathLengthMatrix( adj_list, endpoints=None, max_length=None ):
+    '''
+    Path count and min/max etch length between every pair of endpoints (components, defaults to EndpointComponents()).
+    Returns { ( start, end ): ( number of paths, min length, max length ) } for every pair with at least one path,
+        each pair listed once in the order the endpoints are given.
+
+    Instead of one search per pair, there is one search per start component that keeps going through the endpoints it reaches,
+        so every pair sharing a start shares the same traversal.
+    '''
+    graph = AsCompactGraph( adj_list )
+    if endpoints is None:
+        endpoints = EndpointComponents( graph )
+
+    pair_lengths = {}
+    for i, start in enumerate( endpoints ):
+        # paths from later endpoints back to this one are the same paths reversed, so only search forward
+        targets = set( endpoints[ i+1: ] )
+        if not targets:
+            break
+        for end, _, path_length in WalkPathsToTargets( graph, start, targets, max_length, stop_at_targets=False ):
+            num_paths, min_length, max_length_found = pair_lengths.get( ( start, end ), ( 0, path_length, path_length ) )
+            pair_lengths[ ( start, end ) ] = ( num_paths + 1, min( min_length, path_length ), max( max_length_found, path_length ) )
+
+    return pair_lengths
+
+def IterPaths( adj_list, start_node, end_node, max_paths=None, max_length=None ):
+    '''
+    Yields ( path, etch length ) for every valid path from start_node to end_node, one at a time.
+
+    Stops after max_paths paths, and never yields (or keeps searching along) a path longer than max_length MILs.
+    Nothing is stored between calls, so every call is an independent search.
+    '''
+    if max_paths is not None and max_paths < 1:
+        return
+
+    for path_num, path_data in enumerate( WalkValidPaths( adj_list, start_node, end_node, max_length ), start = 1 ):
+        yield path_data
+        if path_num == max_paths:
+            return
+
+@profiler.Timed( 'shortest_paths' )
+def ShortestPaths( adj_list, start_node, end_node, k=1, max_length=None ):
+    '''
+    Returns the k shortest valid paths from start_node to end_node as ( path, etch length ), shortest first.
+
+    Trace segments are weighted by their length, every other component weighs nothing.
+    Paths follow the same rules as WalkPathsToTargets(), and are found with an A* search over partial paths:
+        * a Dijkstra pass outward from the end component gives the shortest possible remaining length from every component
+            (ignoring the pin rules, so it never overestimates)
+        * partial paths are expanded cheapest (length so far + shortest possible remaining length) first,
+            so complete paths come off the queue in order of length and the search stops after the k-th one
+        * components that can't reach the end component at all are never expanded
+    '''
+    graph = AsCompactGraph( adj_list )
+    ExitPins = ExitPinsFunction( graph )
+    node_component = graph.node_component.tolist()
+    component_lengths = graph.component_lengths.tolist()
+    component_dni = graph.component_dni.tolist()
+
+    start_component = ComponentId( graph, start_node )
+    end_component = ComponentId( graph, end_node )
+    if start_component is None or end_component is None:
+        return []
+
+    # Dijkstra from the end component: shortest length from each component (inclusive) to the end of the path
+    dist_to_end = { end_component: component_lengths[ end_component ] }
+    dijkstra_queue = [ ( dist_to_end[ end_component ], end_component ) ]
+    while dijkstra_queue:
+        dist, component = heapq.heappop( dijkstra_queue )
+        if dist > dist_to_end[ component ]:
+            continue
+        for neighbor_pin in ExitPins( component, None ):
+            neighbor = node_component[ neighbor_pin ]
+            if component_dni[ neighbor ] and neighbor != start_component:
+                continue
+            neighbor_dist = dist + component_lengths[ neighbor ]
+            if neighbor_dist < dist_to_end.get( neighbor, float( 'inf' ) ):
+                dist_to_end[ neighbor ] = neighbor_dist
+                heapq.heappush( dijkstra_queue, ( neighbor_dist, neighbor ) )
+
+    shortest_paths = []
+    if start_component not in dist_to_end or k < 1:
+        return shortest_paths
+
+    # queue entries: ( estimated total length, tie breaker, length so far, path, pin the last component was entered on )
+    tie_breaker = 0
+    path_queue = [ ( dist_to_end[ start_component ], tie_breaker, component_lengths[ start_component ], ( start_component, ), None ) ]
+    while path_queue and len( shortest_paths ) < k:
+        _, _, path_length, path, entry_pin = heapq.heappop( path_queue )
+        profiler.stats.Count( 'shortest_paths.nodes_expanded' )
+        component = path[-1]
+        if component == end_component:
+            shortest_paths.append( ( [ graph.component_names[ c ] for c in path ], path_length ) )
+            continue
+
+        for next_pin in ExitPins( component, entry_pin ):
+            next_component = node_component[ next_pin ]
+            if next_component not in dist_to_end or next_component in path:
+                continue
+            next_length = path_length + component_lengths[ next_component ]
+            if max_length is not None and next_length > max_length:
+                continue
+            # remaining length from the next component = dist_to_end of the next component minus its own length
+            estimated_length = next_length + dist_to_end[ next_component ] - component_lengths[ next_component ]
+            tie_breaker += 1
+            heapq.heappush( path_queue, ( estimated_length, tie_breaker, next_length, path + ( next_component, ), next_pin ) )
+
+    return shortest_paths
+
+def FindValidPaths( adj_list, start_node, end_node ):
+    '''
+    Equivalent of FindAllPaths() -> GetValidPaths() -> RemoveLRNodes() -> RemoveDNIPaths(), without enumerating the invalid paths first
+    '''
+    return [ path for path, _ in WalkValidPaths( adj_list, start_node, end_node ) ]
+
 # Returns the sum of all trace segments in the path in MILs
 def PathLength( path ):
-    trace_len_sum = 0
-    for node in path:
-        if lt.LookupComponentType( node ) == 'Trace':
-            trace_len_sum += lt.LookupTraceLength( node )
-    return trace_len_sum
+    return sum( ComponentLength( node ) for node in path )
 
 def GetPathRefDes( node_path, top_file ):
-    save_topo_file = lt.GetTopologyFile()
-    lt.SetTopologyFile( top_file )
-
-    path_refDes = [ lt.LookupRefDes( node ) for node in node_path ]
-
-    # restore topology file for lookup api in case it was a different one
-    lt.SetTopologyFile( save_topo_file )
-    return path_refDes
+    return lt.GetTopologyIndex( top_file ).PathRefDes( node_path )
 
 def ConnectionPaths():
-    return connectionPaths.copy()
\ No newline at end of file
+    '''
+    Paths found by the last FindAllPaths() in this thread
+    '''
+    return getattr( last_search, 'connectionPaths', [] ).copy()
\ No newline at end of file